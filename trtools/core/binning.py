@@ -5,33 +5,111 @@
     The main conceit is that the index of the output is the same. This allows us to preallocate 
     the output. 
 
-    We also keep a single intermediary dataframe and re-use it for apply funcs. 
+    Bins are passed to func as row slices of the data. With raw=True we keep a single 
+    GroupView and rebind it for each bin instead. 
 
     We support dict of Series as output to cut down on intermediary DataFrame construction
     Which is only workable since we assume the indexes are the same. 
+
+    Common reductions passed by name ('mean', 'sum', ...) or as a ufunc skip the per-bin 
+    func call entirely and are computed with reduceat over the bin edges. 
 """
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import operator
+
 import numpy as np
 import pandas as pd
 from pandas.core.groupby import DataFrameGroupBy, SeriesGroupBy, BinGrouper
 
 import trtools.core.timeseries as ts # downsample moneky patch
+from trtools.core.topper import topn_2d
 from trtools.monkey import patch
+from trtools.tools.parallel import resolve_n_jobs, share_array, attach_array
+
+class GroupView(object):
+    """
+        Zero-copy view over a contiguous run of rows of a DataFrame.
+
+        The column arrays are pulled out once and each bind() just moves the
+        start/end, so rebinding between bins is O(1). Column access returns
+        ndarray slices of the original data. This is what apply_put passes
+        to func with raw=True, in place of swapping the BlockManager of a
+        reused DataFrame, which broke between pandas versions.
+
+        >>> view = GroupView(df)
+        >>> view.bind(0, 10)['close'] # ndarray view of df.close[0:10]
+        >>> view.frame() # DataFrame of the bound rows
+    """
+    def __init__(self, data):
+        self.obj = data
+        self.columns = data.columns
+        self._index = data.index
+        self._arrays = [data.iloc[:, i].values for i in range(len(data.columns))]
+        self.start = 0
+        self.end = len(data)
+
+    def bind(self, start, end):
+        self.start = start
+        self.end = end
+        return self
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def index(self):
+        return self._index[self.start:self.end]
+
+    def __getitem__(self, key):
+        loc = self.columns.get_loc(key)
+        return self._arrays[loc][self.start:self.end]
+
+    def __getattr__(self, key):
+        if key.startswith('_') or '_arrays' not in self.__dict__:
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError("{0} not a column of GroupView".format(key))
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def keys(self):
+        return self.columns
+
+    def series(self, key):
+        return pd.Series(self[key], index=self.index, name=key)
+
+    def frame(self):
+        """
+            DataFrame of the bound rows, a row slice of the original
+        """
+        return self.obj.iloc[self.start:self.end]
 
-def apply_put_series(data, grouper, func, *args, **kwargs):
+def apply_put_series(data, grouper, func, *args, n_jobs=None, backend='thread', **kwargs):
+    how = _fast_how(func, args, kwargs)
+    if how is not None and _is_numeric(data.dtype):
+        return pd.Series(bin_broadcast(data.values, grouper, how), index=data.index)
+    func = _how_func(func)
 
     # grab first result to find dtype
     first = grouper.bins[0]
     res = func(data[0:first], *args, **kwargs)
-    out = np.empty(len(data), dtype=res.dtype)  
+    out = np.empty(len(data), dtype=_result_dtype(res))  
     out[0:first] = res
 
-    start = first
-    for bin in grouper.bins[1:]:
+    _put_bins(_put_series_loop, data, grouper.bins[1:], first, func, args, kwargs, out,
+              n_jobs=n_jobs, backend=backend)
+    return pd.Series(out, index=data.index) 
+
+def _put_series_loop(data, bins, start, func, args, kwargs, out):
+    for bin in bins:
         if start == bin:
             continue
         out[start:bin] = func(data[start:bin], *args, **kwargs)
         start = bin
-    return pd.Series(out, index=data.index) 
 
 def _empty_dataframe(data, res):
     """
@@ -45,9 +123,16 @@ def _empty_dataframe(data, res):
     return out
 
 def _empty_series(data, res):
-    out = np.empty(len(data), dtype=res.dtype)  
+    out = np.empty(len(data), dtype=_result_dtype(res))  
     return out
 
+def _result_dtype(res):
+    # python scalars from object columns don't have a dtype
+    dtype = np.asarray(res).dtype
+    if dtype.kind in 'SU':
+        dtype = np.dtype(object)
+    return dtype
+
 def apply_result_series(out, res, start, end):
     out[start:end] = res.values
 
@@ -59,25 +144,42 @@ def apply_result_dict(out, res, start, end):
     for k in list(out.keys()):
         out[k][start:end] = res[k]
 
-def _func_dict_wrapper(func):
+class _func_dict_wrapper(object):
     """
         Wrapper for handling {'col':func}
+
+        A class instead of a closure so it can be pickled for the process
+        backend.
     """
-    def _wrapped(group, *args, **kwargs):
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, group, *args, **kwargs):
         res = {}
-        for col, f in list(func.items()):
+        for col, f in list(self.func.items()):
             res[col] = f(group[col], *args, **kwargs)
 
         return res
-    return _wrapped
 
-def apply_put_frame(data, grouper, func, *args, **kwargs):
+def apply_put_frame(data, grouper, func, *args, n_jobs=None, backend='thread', raw=False,
+                    **kwargs):
+    fast = _fast_frame(data, grouper, func, args, kwargs)
+    if fast is not None:
+        return fast
+
+    if not isinstance(func, dict) and _fast_how(func, args, kwargs) is not None:
+        # reduction on non numeric data, run it per column
+        func = OrderedDict((col, func) for col in data.columns)
     if isinstance(func, dict):
+        func = OrderedDict((col, _how_func(f)) for col, f in func.items())
         func = _func_dict_wrapper(func)
 
     # grab first result to find dtype
     first = grouper.bins[0]
-    first_data = data[:first]
+    if raw:
+        first_data = GroupView(data).bind(0, first)
+    else:
+        first_data = data.iloc[0:first]
     res = func(first_data, *args, **kwargs)
 
     # assuming that res and data will share same index
@@ -95,32 +197,344 @@ def apply_put_frame(data, grouper, func, *args, **kwargs):
         apply_result = apply_result_dict
 
     apply_result(out, res, 0, first)
+    columns = list(res.keys())
+
+    _put_bins(_put_frame_loop, data, grouper.bins[1:], first, func, args, kwargs, out,
+              apply_result, raw, n_jobs=n_jobs, backend=backend)
+
+    if isinstance(out, dict):
+        return pd.DataFrame(out, index=data.index, columns=columns)
+
+    if out.ndim > 1:
+        return pd.DataFrame(out, index=data.index, columns=res.columns)
+    else:
+        return pd.Series(out, index=data.index)
 
-    group = data.head() # reuse this dataframe below
-    start = first
-    for bin in grouper.bins[1:]:
+def _put_frame_loop(data, bins, start, func, args, kwargs, out, apply_result, raw=False):
+    if raw:
+        group = GroupView(data) # rebind this view below
+    for bin in bins:
         if start == bin:
             continue
-        # HACK. Reuse the group dataframe and just replace it's block manager
-        # must faster without creating new dataframes
-        #group = data[start:bin]
-        ds = data._data.get_slice(slice(start,bin), 1)
-        group._data = ds
-        group._clear_item_cache()
-
-        res = func(group, *args, **kwargs)
+        if raw:
+            res = func(group.bind(start, bin), *args, **kwargs)
+        else:
+            res = func(data.iloc[start:bin], *args, **kwargs)
         apply_result(out, res, start, bin)
         start = bin
 
+def _slice_out(out, start, end):
     if isinstance(out, dict):
-        return pd.DataFrame(out, index=data.index, columns=list(res.keys()))
+        return OrderedDict((k, v[start:end]) for k, v in out.items())
+    return out[start:end]
 
-    if out.ndim > 1:
-        return pd.DataFrame(out, index=data.index, columns=res.columns)
+def _bin_chunks(bins, start, n_chunks):
+    """
+        Split bins into contiguous chunks. Returns a list of
+        (chunk_start, chunk_end, bins relative to chunk_start)
+    """
+    bins = np.asarray(bins, dtype=int)
+    chunks = []
+    for chunk in np.array_split(bins, n_chunks):
+        if len(chunk) == 0:
+            continue
+        chunks.append((start, chunk[-1], chunk - start))
+        start = chunk[-1]
+    return chunks
+
+def _put_bins(loop, data, bins, start, func, args, kwargs, out, *loop_args, **options):
+    """
+        Run the put loop over bins. With n_jobs the bins are split into
+        contiguous chunks and each chunk writes into its own slice of out, so
+        the result is the same as running serially.
+
+        Parameters
+        ----------
+        n_jobs : int
+            See trtools.tools.parallel.resolve_n_jobs
+        backend : 'thread' or 'process'
+            The process backend needs func to be picklable. out is copied
+            into shared memory and the workers write into that.
+    """
+    n_jobs = resolve_n_jobs(options.get('n_jobs'))
+    backend = options.get('backend', 'thread')
+
+    if n_jobs == 1 or len(bins) < 2:
+        loop(data, bins, start, func, args, kwargs, out, *loop_args)
+        return
+
+    chunks = _bin_chunks(bins, start, n_jobs)
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(loop, data[cs:ce], chunk_bins, 0, func, args,
+                                       kwargs, _slice_out(out, cs, ce), *loop_args)
+                       for cs, ce, chunk_bins in chunks]
+            for future in futures:
+                future.result()
+        return
+
+    if backend != 'process':
+        raise Exception("backend must be 'thread' or 'process'")
+
+    keys = list(out.keys()) if isinstance(out, dict) else [None]
+    arrays = [out[k] for k in keys] if isinstance(out, dict) else [out]
+    shared = [share_array(arr) for arr in arrays]
+    specs = dict((k, spec) for k, (spec, _, _) in zip(keys, shared))
+    shms = [shm for _, shm, _ in shared]
+    views = [view for _, _, view in shared]
+    del shared
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_process_put, loop, data[cs:ce], chunk_bins, func,
+                                       args, kwargs, specs, cs, ce, loop_args)
+                       for cs, ce, chunk_bins in chunks]
+            for future in futures:
+                future.result()
+        for i, arr in enumerate(arrays):
+            arr[:] = views[i]
+    finally:
+        # views need to be released before the shared memory can close
+        del views
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+def _process_put(loop, data, bins, func, args, kwargs, specs, start, end, loop_args):
+    """
+        Runs in the worker process. Attach to the shared out and run the
+        loop over this chunk's slice.
+    """
+    attached = dict((k, attach_array(spec)) for k, spec in specs.items())
+    shms = [shm for shm, _ in attached.values()]
+    out = None
+    try:
+        if None in attached:
+            out = attached[None][1][start:end]
+        else:
+            out = OrderedDict((k, view[start:end]) for k, (_, view) in attached.items())
+        loop(data, bins, 0, func, args, kwargs, out, *loop_args)
+    finally:
+        out = None
+        attached = None
+        for shm in shms:
+            shm.close()
+
+# Reductions that can skip the per-bin python call. These are broadcast back
+# to the original index the same way a func returning a scalar would be.
+FAST_HOWS = ['mean', 'sum', 'max', 'min', 'first', 'last', 'cumsum']
+
+_fast_funcs = {
+    np.sum: 'sum',
+    # no np.nansum, it gives 0 for an all nan bin and 'sum' gives nan
+    np.mean: 'mean',
+    np.nanmean: 'mean',
+    np.max: 'max',
+    np.nanmax: 'max',
+    np.min: 'min',
+    np.nanmin: 'min',
+    np.cumsum: 'cumsum',
+}
+
+def _fast_how(func, args=(), kwargs=None):
+    """
+        Return the fast path for func or None if we need to call it per bin
+    """
+    if args or kwargs:
+        return None
+    if isinstance(func, str):
+        if func not in FAST_HOWS:
+            raise Exception("{0} is not one of {1}".format(func, FAST_HOWS))
+        return func
+    if isinstance(func, np.ufunc) and func.nin == 2:
+        return func
+    if isinstance(func, dict):
+        return None
+    return _fast_funcs.get(func)
+
+def _fast_frame(data, grouper, func, args, kwargs):
+    if isinstance(func, dict):
+        hows = OrderedDict((col, _fast_how(f, args, kwargs)) for col, f in func.items())
     else:
-        return pd.Series(out, index=data.index)
+        how = _fast_how(func, args, kwargs)
+        hows = OrderedDict((col, how) for col in data.columns)
+
+    if any(how is None for how in hows.values()):
+        return None
+    # the kernels are numeric only, the rest go through pandas per bin
+    if not all(_is_numeric(data[col].dtype) for col in hows):
+        return None
+
+    out = OrderedDict()
+    for col, how in hows.items():
+        out[col] = bin_broadcast(data[col].values, grouper, how)
+    return pd.DataFrame(out, index=data.index, columns=list(hows.keys()))
+
+def _is_numeric(dtype):
+    return dtype.kind in 'iufc'
+
+def _first_valid(s):
+    s = s.dropna()
+    return s.iloc[0] if len(s) else np.nan
+
+def _last_valid(s):
+    s = s.dropna()
+    return s.iloc[-1] if len(s) else np.nan
+
+def _how_func(how):
+    """
+        Per bin version of a FAST_HOWS name or ufunc, for the data the
+        kernels don't handle. Other funcs are returned as is.
+    """
+    if isinstance(how, np.ufunc):
+        return how.reduce
+    if not isinstance(how, str):
+        return how
+    if how == 'first':
+        return _first_valid
+    if how == 'last':
+        return _last_valid
+    return operator.methodcaller(how)
+
+def _bin_reduce(values, starts, ends, how):
+    """
+        Reduce each [start, end) bin in one vectorized pass. Bins must be
+        non-empty since reduceat doesn't handle empty segments.
+
+        Like the pandas reductions, nans are skipped. A ufunc is run through
+        ufunc.reduceat as is.
+    """
+    vals = values[:ends[-1]]
+    if isinstance(how, np.ufunc):
+        return how.reduceat(vals, starts)
+
+    counts = ends - starts
+    mask = None
+    if vals.dtype.kind in 'fc':
+        mask = np.isnan(vals)
+        counts = np.add.reduceat(~mask, starts)
+
+    if how in ('sum', 'mean'):
+        if mask is not None:
+            vals = np.where(mask, 0, vals)
+        total = np.add.reduceat(vals, starts)
+        if how == 'sum':
+            if mask is not None:
+                # like the pandas sum, bins without any values are nan
+                total[counts == 0] = np.nan
+            return total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / counts
+
+    if how in ('max', 'min'):
+        ufunc = np.maximum if how == 'max' else np.minimum
+        if mask is None:
+            return ufunc.reduceat(vals, starts)
+        fill = -np.inf if how == 'max' else np.inf
+        res = ufunc.reduceat(np.where(mask, fill, vals), starts)
+        res[counts == 0] = np.nan
+        return res
+
+    if how in ('first', 'last'):
+        # reduce over positions of valid values, then take
+        pos = np.arange(len(vals))
+        if vals.ndim == 2:
+            # each column reduces on its own
+            pos = np.repeat(pos[:, None], vals.shape[1], axis=1)
+        if how == 'first':
+            missing = len(vals)
+            ufunc = np.minimum
+        else:
+            missing = -1
+            ufunc = np.maximum
+        if mask is not None:
+            pos = np.where(mask, missing, pos)
+        pos = ufunc.reduceat(pos, starts)
+        clipped = pos.clip(0, len(vals) - 1)
+        if vals.ndim == 2:
+            res = vals[clipped, np.arange(vals.shape[1])]
+        else:
+            res = vals.take(clipped)
+        if mask is not None:
+            res[pos == missing] = np.nan
+        return res
+
+    raise Exception("{0} is not one of {1}".format(how, FAST_HOWS))
+
+def _bin_cumsum(values, starts, ends):
+    """
+        cumsum within each bin by subtracting the running total at the
+        start of each bin. nans are skipped and left in place.
+    """
+    vals = values[:ends[-1]]
+    mask = None
+    if vals.dtype.kind in 'fc':
+        mask = np.isnan(vals)
+        vals = np.where(mask, 0, vals)
+    total = np.cumsum(vals)
+    offsets = np.zeros(len(starts), dtype=total.dtype)
+    offsets[starts > 0] = total[starts[starts > 0] - 1]
+    res = total - np.repeat(offsets, ends - starts)
+    if mask is not None:
+        res[mask] = np.nan
+    return res
+
+def bin_broadcast(values, grouper, how):
+    """
+        Reduce each bin of values and broadcast the result back to every row
+        in the bin. Rows past the last bin are left as nan.
+
+        Parameters
+        ----------
+        values : ndarray
+        grouper : BinGrouper
+        how : string or ufunc
+            One of FAST_HOWS or a binary ufunc
+    """
+    starts, ends = _bin_edges(grouper)
+    nonempty = ends > starts
+    starts = starts[nonempty]
+    ends = ends[nonempty]
+
+    if len(starts) == 0:
+        out = np.empty(len(values))
+        out[:] = np.nan
+        return out
+
+    if how == 'cumsum':
+        res = _bin_cumsum(values, starts, ends)
+    else:
+        res = _bin_reduce(values, starts, ends, how)
+        res = np.repeat(res, ends - starts)
+
+    if len(res) == len(values):
+        return res
+
+    if res.dtype.kind not in 'fc':
+        res = res.astype(float)
+    out = np.empty(len(values), dtype=res.dtype)
+    out[:] = np.nan
+    out[:len(res)] = res
+    return out
 
 def apply_put(data, grouper, func, *args, **kwargs):
+    """
+        Parameters
+        ----------
+        data : Series or DataFrame
+        grouper : BinGrouper
+        func : callable, dict of {col: callable}, ufunc or string
+            Strings in FAST_HOWS and binary ufuncs skip the per-bin call.
+        n_jobs : int, optional
+            Split the bins into contiguous chunks and run them in parallel.
+            Output is the same as running serially.
+        backend : 'thread' or 'process'
+            Process backend writes into shared memory and requires a
+            picklable func.
+        raw : bool
+            DataFrame only. Pass func a GroupView instead of a DataFrame.
+            Column access returns ndarray views which skips creating a
+            DataFrame per bin.
+    """
     if isinstance(data, pd.Series):
         return apply_put_series(data, grouper, func, *args, **kwargs)
 
@@ -129,8 +543,139 @@ def apply_put(data, grouper, func, *args, **kwargs):
 
 @patch([SeriesGroupBy, DataFrameGroupBy], 'apply_put')
 def apply_put_monkey(self, func, *args, **kwargs):
+    grouper = self.grouper
+    obj = self.obj
+    if not isinstance(grouper, BinGrouper):
+        return apply_put_grouper(obj, grouper, func, *args, **kwargs)
+    return apply_put(obj, grouper, func, *args, **kwargs)
+
+def sorted_bins(grouper):
+    """
+        Turn any grouper into contiguous bins.
+
+        Returns
+        -------
+        perm : ndarray
+            Stable sort of the rows by group. Rows with a NA group key are
+            left out.
+        bin_grouper : BinGrouper
+            bins over the data once it has been taken by perm
+    """
+    comp_ids, _, ngroups = grouper.group_info
+    comp_ids = np.asarray(comp_ids)
+    perm = np.argsort(comp_ids, kind='mergesort')
+    # NA keys are -1 and sort first
+    na_count = (comp_ids == -1).sum()
+    perm = perm[na_count:]
+    counts = np.bincount(comp_ids[comp_ids >= 0], minlength=ngroups)
+    bins = np.cumsum(counts)
+    return perm, BinGrouper(bins, grouper.result_index)
+
+def _unpermute(values, perm, length):
+    """
+        Scatter values that are in perm order back into original row order.
+        Rows not in perm are nan.
+    """
+    dtype = values.dtype
+    if len(perm) < length and dtype.kind in 'iub':
+        dtype = np.float64
+    out = np.empty(length, dtype=dtype)
+    if len(perm) < length:
+        out[:] = np.nan
+    out[perm] = values
+    return out
+
+def apply_put_grouper(data, grouper, func, *args, **kwargs):
+    """
+        apply_put for groupers that aren't bin based, i.e. grouping by
+        symbol or sector. The rows are sorted by group once so each group is
+        a contiguous bin, run through apply_put, and then scattered back into
+        the original order.
+    """
+    perm, bin_grouper = sorted_bins(grouper)
+    res = apply_put(data.take(perm), bin_grouper, func, *args, **kwargs)
+
+    if isinstance(res, pd.Series):
+        out = _unpermute(res.values, perm, len(data))
+        return pd.Series(out, index=data.index, name=data.name)
+
+    out = OrderedDict()
+    for col, series in res.items():
+        out[col] = _unpermute(series.values, perm, len(data))
+    return pd.DataFrame(out, index=data.index, columns=res.columns)
+
+def _bin_edges(grouper):
+    """ Return the (starts, ends) of each bin """
+    ends = np.asarray(grouper.bins, dtype=int)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1]
+    return starts, ends
+
+def _bin_matrix(values, starts, ends):
+    """
+        Lay out each bin as a row of a (bins x max bin length) matrix padded
+        with nan. topn_2d then ranks every bin in one pass.
+    """
+    lengths = ends - starts
+    width = max(lengths.max(), 1) if len(lengths) else 1
+    mat = np.empty((len(lengths), width))
+    mat[:] = np.nan
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(starts, lengths)
+    mat[rows, offsets] = values[:ends[-1]]
+    return mat
+
+def bin_topn(values, grouper, N, ascending=None):
+    """
+        topn for each bin of a 1-D array without creating a group per bin.
+
+        Returns
+        -------
+        TopNResult where each row is a bin. positions are into `values`
+        and not relative to the start of the bin.
+    """
+    starts, ends = _bin_edges(grouper)
+    values = np.asarray(values, dtype=float)
+    mat = _bin_matrix(values, starts, ends)
+    res = topn_2d(mat, N, ascending=ascending)
+    positions = res.positions + starts[:, None]
+    positions[~res.valid] = -1
+    res.positions = positions
+    return res
+
+@patch([SeriesGroupBy, DataFrameGroupBy], 'topn')
+def topn_grouped(self, N, ascending=None):
+    """
+        topn for each group. The result is indexed by (group, rank). Ranks
+        that are nan for every column are dropped.
+
+        On a DataFrame groupby each column is ranked on its own within the
+        group, like Series.topn per column. This is not DataFrame.topn,
+        which ranks each row across columns.
+    """
     grouper = self.grouper
     if not isinstance(grouper, BinGrouper):
         raise Exception("grouper must be BinGrouper")
     obj = self.obj
-    return apply_put(obj, grouper, func, *args, **kwargs)
+
+    if isinstance(obj, pd.Series):
+        data = bin_topn(obj.values, grouper, N, ascending).values
+        nbins, k = data.shape
+        index = _rank_index(grouper.binlabels, k)
+        out = pd.Series(data.ravel(), index=index, name=obj.name)
+        return out.dropna()
+
+    data = OrderedDict()
+    for col, series in obj.items():
+        data[col] = bin_topn(series.values, grouper, N, ascending).values
+
+    nbins, k = next(iter(data.values())).shape
+    index = _rank_index(grouper.binlabels, k)
+    data = OrderedDict((col, vals.ravel()) for col, vals in data.items())
+    out = pd.DataFrame(data, index=index, columns=obj.columns)
+    return out.dropna(how='all')
+
+def _rank_index(binlabels, k):
+    return pd.MultiIndex.from_arrays([binlabels.repeat(k),
+                                      np.tile(np.arange(k), len(binlabels))])
@@ -1,12 +1,17 @@
 import os.path
 from collections import OrderedDict, Iterable
+from collections.abc import ItemsView, ValuesView
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import operator
+import math
 
 import numpy as np
 from pandas import Series, Panel, DataFrame, Panel4D
 import pandas as pd
 
 import trtools.io.api as trio
+from trtools.core.timeseries import fillforward_frames
+from trtools.tools.parallel import resolve_n_jobs, chunker, share_array, attach_array
 
 import trtools.monkey as monkey
 import collections
@@ -59,14 +64,31 @@ class PanelDict(OrderedDict):
         else: 
             return monkey.AttrProxy(key, test, lambda _, key: _wrap(self, key))
 
-def apply_cp(self, func, *args, **kwargs):
+def apply_cp(self, func, *args, n_jobs=None, backend='thread', chunksize=None, **kwargs):
     """
         apply func to each frame and wrap
         based on return
+
+        Parameters
+        ----------
+        n_jobs : int
+            See trtools.tools.parallel.resolve_n_jobs
+        backend : 'thread' or 'process'
+            The process backend needs func to be picklable. Block backed
+            ColumnPanels send their blocks through shared memory, otherwise
+            the frames are pickled in chunks. Workers get a copy of each frame.
+        chunksize : int
+            Items per process task. Defaults to 4 tasks per job.
     """
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1:
+        results = ((key, func(df, *args, **kwargs)) for key, df in self.iteritems())
+    else:
+        results = _apply_parallel(self, func, args, kwargs, n_jobs, backend, chunksize)
+
     data = PanelDict() 
-    for key, df in self.iteritems():
-        data[key] = func(df, *args, **kwargs)
+    for key, res in results:
+        data[key] = res
 
     if len(data) == 0:
         return 
@@ -75,6 +97,85 @@ def apply_cp(self, func, *args, **kwargs):
     data = _box_items(data)
     return data
 
+def _apply_parallel(self, func, args, kwargs, n_jobs, backend, chunksize):
+    """
+        Returns a list of (key, result) in item order
+    """
+    if backend not in ('thread', 'process'):
+        raise Exception("backend must be 'thread' or 'process'")
+
+    block = self._block if isinstance(self, ColumnPanel) else None
+    if backend == 'process' and block is not None:
+        return _apply_shared(self, func, args, kwargs, n_jobs, chunksize)
+
+    items = list(self.iteritems())
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(func, df, *args, **kwargs) for _, df in items]
+            return [(key, future.result()) for (key, _), future in zip(items, futures)]
+
+    chunksize = chunksize or _default_chunksize(len(items), n_jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(_apply_chunk, func, chunk, args, kwargs)
+                   for chunk in chunker(items, chunksize)]
+        return [res for future in futures for res in future.result()]
+
+def _default_chunksize(count, n_jobs):
+    return max(int(math.ceil(count / (n_jobs * 4.))), 1)
+
+def _apply_chunk(func, items, args, kwargs):
+    return [(key, func(df, *args, **kwargs)) for key, df in items]
+
+def _apply_shared(self, func, args, kwargs, n_jobs, chunksize):
+    """
+        Process backend for block storage. The blocks are copied into
+        shared memory once and each worker rebuilds its frames from there.
+    """
+    block = self._block
+    shared = [(dtype, share_array(arr)) for dtype, arr in block.blocks.items()]
+    specs = dict((dtype, spec) for dtype, (spec, _, _) in shared)
+    shms = [shm for _, (_, shm, _) in shared]
+    # views need to be released before the shared memory can close
+    shared = None
+    layout = (block.items, block.index, block.locs)
+    positions = list(range(len(block.items)))
+    chunksize = chunksize or _default_chunksize(len(positions), n_jobs)
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_apply_shared_chunk, func, layout, specs, chunk,
+                                       self.frame_wrapper, args, kwargs)
+                       for chunk in chunker(positions, chunksize)]
+            return [res for future in futures for res in future.result()]
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+def _apply_shared_chunk(func, layout, specs, positions, frame_wrapper, args, kwargs):
+    """
+        Runs in the worker process.
+    """
+    items, index, locs = layout
+    attached = dict((dtype, attach_array(spec)) for dtype, spec in specs.items())
+    shms = [shm for shm, _ in attached.values()]
+    blocks = None
+    try:
+        blocks = dict((dtype, view) for dtype, (_, view) in attached.items())
+        blocks = PanelBlocks(items, index, blocks, locs)
+        results = []
+        for i in positions:
+            # copy so func can't write into or hand back shared memory
+            df = blocks.frame(i).copy()
+            if frame_wrapper:
+                df = frame_wrapper(df, items[i])
+            results.append((items[i], func(df, *args, **kwargs)))
+        return results
+    finally:
+        blocks = None
+        attached = None
+        for shm in shms:
+            shm.close()
+
 def _box_items(data):
     test = data[list(data.keys())[0]]
     if isinstance(test, ColumnPanel):
@@ -295,30 +396,459 @@ def na_promote(df):
 
     return df
 
+def _as_selector(positions, length):
+    """
+        Position array to a slice when it's a contiguous run
+    """
+    if positions is None:
+        return slice(None)
+    if isinstance(positions, slice):
+        return positions
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return slice(0, 0)
+    start = positions[0]
+    if positions[-1] - start + 1 == len(positions) and \
+       np.all(np.diff(positions) == 1):
+        return slice(start, start + len(positions))
+    return positions
+
+def _interleaved_dtype(dtypes):
+    """
+        dtype of df.values for a frame with these column dtypes
+    """
+    dtypes = set(np.dtype(dtype) for dtype in dtypes)
+    if not dtypes:
+        return np.dtype(float)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if any(dtype.kind in 'bOMmSU' for dtype in dtypes):
+        return np.dtype(object)
+    return np.result_type(*dtypes)
+
+class PanelBlocks(object):
+    """
+        Block storage for ColumnPanel. One (items x index x columns) ndarray
+        per dtype, all sharing one index. Columns come out as zero-copy
+        (index x items) views. Frames are views as long as every column
+        shares a dtype, which is the case until a column of another dtype
+        is added.
+    """
+    def __init__(self, items, index, blocks, locs):
+        self.items = items
+        self.index = index
+        # dtype -> ndarray
+        self.blocks = blocks
+        # column -> (dtype, position in block)
+        self.locs = locs
+
+    @classmethod
+    def from_frames(cls, frames):
+        # same item order as Panel(dict)
+        if not isinstance(frames, OrderedDict):
+            keys = list(frames.keys())
+            try:
+                keys = sorted(keys)
+            except TypeError:
+                pass
+            frames = OrderedDict((k, frames[k]) for k in keys)
+        index = None
+        columns = None
+        for df in frames.values():
+            if index is None:
+                index, columns = df.index, df.columns
+                continue
+            if not df.index.equals(index):
+                index = index.union(df.index)
+            if not df.columns.equals(columns):
+                columns = columns.union(df.columns)
+
+        aligned = []
+        for df in frames.values():
+            if not (df.index.equals(index) and df.columns.equals(columns)):
+                df = df.reindex(index=index, columns=columns)
+            aligned.append(df)
+
+        # upcast like the Panel constructor, so frames match frames mode
+        dtype = _interleaved_dtype([_interleaved_dtype(df.dtypes) for df in aligned])
+        block = np.empty((len(aligned), len(index), len(columns)), dtype=dtype)
+        for i, df in enumerate(aligned):
+            block[i] = df.values
+        locs = OrderedDict((col, (dtype, pos)) for pos, col in enumerate(columns))
+        return cls(pd.Index(list(frames.keys())), index, {dtype: block}, locs)
+
+    @classmethod
+    def from_fields(cls, items, index, fields):
+        """
+            fields is an OrderedDict of name -> (index x items) arrays
+        """
+        groups = OrderedDict()
+        for name, values in fields.items():
+            groups.setdefault(values.dtype, []).append(name)
+
+        blocks = {}
+        locs = OrderedDict()
+        for dtype, names in groups.items():
+            block = np.empty((len(items), len(index), len(names)), dtype=dtype)
+            for pos, name in enumerate(names):
+                block[:, :, pos] = fields[name].T
+                locs[name] = (dtype, pos)
+            blocks[dtype] = block
+        locs = OrderedDict((name, locs[name]) for name in fields)
+        return cls(items, index, blocks, locs)
+
+    @property
+    def columns(self):
+        return list(self.locs.keys())
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks.values())
+
+    def column(self, key):
+        dtype, pos = self.locs[key]
+        values = self.blocks[dtype][:, :, pos].T
+        df = DataFrame(values, index=self.index, columns=self.items, copy=False)
+        df.name = key
+        return df
+
+    def frame(self, i):
+        if len(self.blocks) == 1:
+            dtype, block = next(iter(self.blocks.items()))
+            cols = sorted(self.locs, key=lambda col: self.locs[col][1])
+            df = DataFrame(block[i], index=self.index, columns=cols, copy=False)
+            if cols != self.columns:
+                df = df.reindex(columns=self.columns, copy=False)
+            return df
+        data = OrderedDict()
+        for col, (dtype, pos) in self.locs.items():
+            data[col] = self.blocks[dtype][i, :, pos]
+        return DataFrame(data, index=self.index, columns=self.columns)
+
+    def set_column(self, key, values):
+        """
+            values is an (index x items) ndarray
+        """
+        values = np.asarray(values)
+        order = self.columns
+        if key in self.locs:
+            dtype, pos = self.locs[key]
+            if np.can_cast(values.dtype, dtype):
+                self.blocks[dtype][:, :, pos] = values.T
+                return
+            self._delete(key)
+        else:
+            order.append(key)
+
+        dtype = values.dtype
+        new = values.T[:, :, None]
+        block = self.blocks.get(dtype)
+        if block is None:
+            self.blocks[dtype] = np.ascontiguousarray(new)
+            pos = 0
+        else:
+            self.blocks[dtype] = np.concatenate([block, new], axis=2)
+            pos = block.shape[2]
+        self.locs[key] = (dtype, pos)
+        self.locs = OrderedDict((col, self.locs[col]) for col in order)
+
+    def _delete(self, key):
+        dtype, pos = self.locs.pop(key)
+        block = np.delete(self.blocks[dtype], pos, axis=2)
+        if block.shape[2] == 0:
+            del self.blocks[dtype]
+            return
+        self.blocks[dtype] = block
+        for col, (d, p) in list(self.locs.items()):
+            if d == dtype and p > pos:
+                self.locs[col] = (d, p - 1)
+
+    def take(self, items=None, rows=None, columns=None):
+        """
+            New PanelBlocks from one selection per block. items and rows are
+            positions or slices, columns are labels. All slices gives views.
+        """
+        if columns is None:
+            columns = self.columns
+        item_sel = _as_selector(items, len(self.items))
+        row_sel = _as_selector(rows, len(self.index))
+
+        blocks = {}
+        locs = OrderedDict()
+        for dtype, block in self.blocks.items():
+            cols = [col for col in columns if self.locs[col][0] == dtype]
+            if not cols:
+                continue
+            col_pos = [self.locs[col][1] for col in cols]
+            col_sel = _as_selector(col_pos, block.shape[2])
+            if isinstance(item_sel, slice) and isinstance(row_sel, slice):
+                new = block[item_sel, row_sel, col_sel]
+            else:
+                item_pos = np.arange(block.shape[0])[item_sel]
+                row_pos = np.arange(block.shape[1])[row_sel]
+                new = block[np.ix_(item_pos, row_pos, col_pos)]
+            blocks[dtype] = new
+            for pos, col in enumerate(cols):
+                locs[col] = (dtype, pos)
+        locs = OrderedDict((col, locs[col]) for col in columns)
+        return PanelBlocks(self.items[item_sel], self.index[row_sel], blocks, locs)
+
+    def to_panel(self):
+        if len(self.blocks) == 1:
+            return Panel(next(iter(self.blocks.values())), items=self.items,
+                         major_axis=self.index, minor_axis=self.columns)
+        data = OrderedDict((k, self.frame(i)) for i, k in enumerate(self.items))
+        return Panel(data)
+
+# default bound on the gathered columns each ColumnPanel keeps around
+COLUMN_CACHE_BYTES = 512 * 1024 ** 2
+
+class ColumnCache(object):
+    """
+        LRU of gathered column frames for a ColumnPanel, bounded by bytes.
+
+        Each entry keeps the panel stamp from when it was gathered. A get
+        with a different stamp is a miss and drops the stale entry.
+    """
+    def __init__(self, maxbytes=None):
+        if maxbytes is None:
+            maxbytes = COLUMN_CACHE_BYTES
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, key, stamp):
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] != stamp:
+            self.pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        # move to most recently used
+        del self._cache[key]
+        self._cache[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, stamp, df):
+        self.pop(key)
+        nbytes = df.values.nbytes
+        if nbytes > self.maxbytes:
+            return
+        self._cache[key] = (stamp, df, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes:
+            _, entry = self._cache.popitem(last=False)
+            self.nbytes -= entry[2]
+
+    def pop(self, key):
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def restamp(self, old, new):
+        """
+            Carry entries that were current under old over to new. For
+            mutations that are known not to touch those columns.
+        """
+        for key, entry in list(self._cache.items()):
+            if entry[0] == old:
+                self._cache[key] = (new,) + entry[1:]
+
+    def clear(self):
+        self._cache.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self),
+                'nbytes': self.nbytes, 'maxbytes': self.maxbytes}
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+class FrameDict(OrderedDict):
+    """
+        OrderedDict for ColumnPanel.frames that counts changes, so the panel
+        knows when its shared index needs to be checked again. Handing out a
+        frame through frames[key] or get() is counted in reads since the
+        caller can edit it in place.
+    """
+    version = 0
+    reads = 0
+
+    def __getitem__(self, key):
+        df = super(FrameDict, self).__getitem__(key)
+        self.reads += 1
+        return df
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super(FrameDict, self).__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super(FrameDict, self).__delitem__(key)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super(FrameDict, self).pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self.version += 1
+        return super(FrameDict, self).popitem(*args, **kwargs)
+
+    def clear(self):
+        self.version += 1
+        super(FrameDict, self).clear()
+
+class BlockFrameDict(FrameDict):
+    """
+        FrameDict over PanelBlocks. Each frame is built from the blocks the
+        first time its key is read instead of all of them up front.
+    """
+    def __init__(self, block, frame_wrapper=None):
+        super(BlockFrameDict, self).__init__()
+        self._block = block
+        self._frame_wrapper = frame_wrapper
+        for name in block.items:
+            # placeholder until read
+            OrderedDict.__setitem__(self, name, None)
+
+    def __getitem__(self, key):
+        df = OrderedDict.__getitem__(self, key)
+        if df is None:
+            df = self._block.frame(self._block.items.get_loc(key))
+            if self._frame_wrapper:
+                df = self._frame_wrapper(df, key)
+            OrderedDict.__setitem__(self, key, df)
+        return df
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return ValuesView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def pop(self, key, *args):
+        if key in self:
+            self[key]
+        return super(BlockFrameDict, self).pop(key, *args)
+
+    def popitem(self, last=True):
+        key = next(reversed(self)) if last else next(iter(self))
+        return key, self.pop(key)
+
+    def copy(self):
+        return FrameDict(self.items())
+
+    def __reduce__(self):
+        return FrameDict, (), None, None, iter(self.items())
+
+    def built(self):
+        """
+            Keys whose frames have been built
+        """
+        return [k for k, v in OrderedDict.items(self) if v is not None]
+
+def _index_fingerprint(index):
+    """
+        (length, first, last, hash of asi8). None for indexes without
+        asi8, those get compared with equals.
+    """
+    values = getattr(index, 'asi8', None)
+    if values is None:
+        return None
+    if not len(values):
+        return (0,)
+    return (len(values), values[0], values[-1], hash(values.tobytes()))
+
+def _same_index(index, other):
+    return _shared_index([index, other])[1]
+
+def _shared_index(indexes):
+    """
+        Returns (index, aligned). Identical objects are skipped, the rest
+        are checked against the first index's fingerprint.
+    """
+    if not indexes:
+        return None, True
+    index = indexes[0]
+    fingerprint = None
+    for ind in indexes[1:]:
+        if ind is index:
+            continue
+        if len(ind) != len(index):
+            return index, False
+        if fingerprint is None:
+            fingerprint = _index_fingerprint(index)
+        other = _index_fingerprint(ind)
+        if fingerprint is None or other is None:
+            if not index.equals(ind):
+                return index, False
+        elif other != fingerprint:
+            return index, False
+    return index, True
+
 class ColumnPanel(object):
-    def __init__(self, obj=None, name=None, frame_wrapper=None):
+    def __init__(self, obj=None, name=None, frame_wrapper=None, storage='frames'):
         """
         frame_wrapper : 
             Used to rewrap frame data into whatever subclass we need. Should
             be able to reconstruct just from key.
+        storage : 'frames' or 'block'
+            'block' keeps the data in PanelBlocks, one ndarray per dtype.
+            Columns and frames are then views into the blocks. New columns
+            should be added through cp[key] = ... and not the frames.
+
+        Gathered columns are cached. Reading a frame through frames[key]
+        drops the cache, so cp.frames[key].ix[:, 'close'] = 2 is seen. A
+        frame kept around and edited after that is not, call touch() then.
         """
         self._columns = []
         self.im = ColumnPanelItems(self)
         self.df_map = ColumnPanelMapper(self)
         self.frame_wrapper = frame_wrapper
 
+        if isinstance(obj, dict) and storage == 'block':
+            # skip the Panel alignment, PanelBlocks aligns on its own
+            obj = PanelBlocks.from_frames(obj)
         if isinstance(obj, dict):
             self._init_dict(obj)
         if isinstance(obj, Panel):
             self._init_panel(obj)
         if isinstance(obj, DataFrame):
             self._init_dataframe(obj, name)
+        if isinstance(obj, PanelBlocks):
+            self._init_block(obj)
+
+        if storage == 'block' and self._block is None:
+            self._init_block(PanelBlocks.from_frames(self.frames))
 
-        self._cache = {}
+        self._cache = ColumnCache()
+        self._versions = OrderedDict()
         self._dirty = False
 
     _frames = None
     _panel = None
+    _block = None
     @property
     def frames(self):
         """
@@ -327,8 +857,10 @@ class ColumnPanel(object):
             This is to save processing when we're just using ColumnPanel as an
             intermediatry step
         """
+        if self._frames is None and self._block is not None:
+            self._frames = BlockFrameDict(self._block, self.frame_wrapper)
         if self._frames is None:
-            self._frames = OrderedDict()
+            self._frames = FrameDict()
             if self._panel is not None:
                 for name, df in self._panel.iteritems():
                     if self.frame_wrapper:
@@ -365,6 +897,13 @@ class ColumnPanel(object):
         self._col_cache = None
         self._panel = panel
 
+    def _init_block(self, block):
+        self._columns = block.columns
+        self._col_cache = None
+        self._block = block
+        self._frames = None
+        self._panel = None
+
     def _init_dataframe(self, df, name=None):
         name = name or df.name
         self._columns = [name]
@@ -377,6 +916,24 @@ class ColumnPanel(object):
             frame.name = col
             self.frames[col] = frame
 
+    @classmethod
+    def from_frames(cls, frames, frame_wrapper=None):
+        """
+            ColumnPanel over frames as is, skipping the Panel alignment.
+            Frames should share the same columns.
+        """
+        cp = cls(frame_wrapper=frame_wrapper)
+        cp._frames = FrameDict(frames)
+        if len(cp._frames):
+            cp._columns = list(next(iter(cp._frames.values())).columns)
+        return cp
+
+    def lazy(self):
+        """
+            LazyColumnPanel view that defers ix/column/item selections
+        """
+        return LazyColumnPanel(self)
+
     def dataset(self):
         """
             Create an empty ColumnPanel with the same items
@@ -401,45 +958,122 @@ class ColumnPanel(object):
             self._pix = PandasPanelIndexer(self)
         return self._pix
 
+    _index_state = None
     @property
     def index(self):
         """
-            Optimally, all frames should share same index. 
-            Test a couple and then return if same. Not sure how to handle
-            non equal indexes.
+            The index shared by all frames. It is found once and kept until
+            the frames change. Raises if the frames are not aligned.
         """
-        import random
-        sample_size = min(len(self.frames), 3)
-        tests = random.sample(self.items, sample_size)
-        indexes = [self.frames[key].index for key in tests]
-        index = indexes[0]
-        try:
-            for ind in indexes[1:]:
-                if not np.all(index == ind):
-                    raise
-        except:
+        index, aligned = self._check_index()
+        if not aligned:
             raise Exception("Indexes are not equal")
-
         return index
 
+    @property
+    def aligned(self):
+        """
+            True when every frame has the same index
+        """
+        return self._check_index()[1]
+
+    def _index_stamp(self):
+        if self._block is not None:
+            return ('block', id(self._block.index))
+        if self._frames is None:
+            return ('panel', id(self._panel))
+        return ('frames', id(self._frames), self._frames.version)
+
+    def _check_index(self):
+        stamp = self._index_stamp()
+        state = self._index_state
+        if state is not None and state[0] == stamp:
+            return state[1]
+
+        if self._block is not None:
+            result = self._block.index, True
+        elif self._frames is None:
+            result = self._panel.major_axis, True
+        else:
+            indexes = [df.index for df in self._frames.values()]
+            result = _shared_index(indexes)
+        self._index_state = (stamp, result)
+        return result
+
     @property
     def items(self):
+        if self._block is not None:
+            return list(self._block.items)
         if self._panel is not None:
             return list(self._panel.items)
         return list(self.frames.keys())
 
     def foreach(self, func, *args, **kwargs):
+        """
+            func(frame) for every item. Takes n_jobs, backend and chunksize,
+            see apply_cp
+        """
         return apply_cp(self, func, *args, **kwargs)
 
     def __setitem__(self, key, value):
+        if self._block is not None:
+            return self._setitem_block(key, value)
+
         self._columns.append(key)
         self._col_cache = None
-        for name, df in self.frames.items():
-            df[key] = value[name]
+        frames = self.frames
+        stamp = self._cache_stamp()
+        if self.aligned and isinstance(value, DataFrame) and \
+           _same_index(value.index, self.index):
+            # skip aligning each item
+            for name, df in frames.items():
+                df[key] = value[name].values
+        else:
+            for name, df in frames.items():
+                df[key] = value[name]
 
-        if key in self._cache:
-            del self._cache[key]
+        # only key changed, keep the other cached columns
+        self._cache.pop(key)
+        self._cache.restamp(stamp, self._cache_stamp())
+        self._dirty = True
+
+    def touch(self, *items):
+        """
+            Bump the version of frames that were modified in place so cached
+            columns get regathered. Only needed for frames that were held onto
+            and edited after a column was read, frames[key] edits and replaced
+            frames are picked up without this. No items touches every frame.
+        """
+        if not items:
+            items = self.items
+        for item in items:
+            self._versions[item] = self._versions.get(item, 0) + 1
+        # in case an index was swapped in place
+        self._index_state = None
 
+    def _cache_stamp(self):
+        versions = tuple(self._versions.items())
+        if self._frames is None:
+            return versions
+        # FrameDict counts every write, catches frames being swapped out.
+        # reads catches edits through a frame handed out by frames[key]
+        frames = self._frames
+        return versions, frames.version, frames.reads
+
+    def cache_info(self):
+        return self._cache.info()
+
+    def _setitem_block(self, key, value):
+        block = self._block
+        if not isinstance(value, DataFrame):
+            value = DataFrame(value)
+        value = value.reindex(index=block.index, columns=block.items)
+        block.set_column(key, value.values)
+        self._columns = block.columns
+        self._col_cache = None
+        # frame views are stale once a block is reallocated
+        self._frames = None
+        self._cache.pop(key)
         self._dirty = True
 
     def __getattr__(self, key):
@@ -496,29 +1130,42 @@ class ColumnPanel(object):
         return ColumnPanel(data)
 
     def _gather_column(self, key):
-        if key in self._cache:
-            return self._cache[key]
+        # block views are cheap, no need to cache
+        if self._block is not None:
+            return self._block.column(key)
+
+        stamp = self._cache_stamp()
+        df = self._cache.get(key, stamp)
+        if df is not None:
+            return df
 
         # if our readonly panel still exists. Grab the data from there
         if self._panel is not None:
             df = self._panel.ix[:, :, key]
         else:
             df = self._gather_frames_column(key)
-        self._cache[key] = df
+        self._cache.set(key, stamp, df)
         return df
 
     def _gather_frames_column(self, key):
         results = {}
-        for name, df in self.frames.items():
-            results[name] = df[key]
-
-        df = DataFrame(results)
+        if self.aligned:
+            # skip the index union
+            for name, df in self.frames.items():
+                results[name] = df[key].values
+            df = DataFrame(results, index=self.index)
+        else:
+            for name, df in self.frames.items():
+                results[name] = df[key]
+            df = DataFrame(results)
         df.name = key
         return df
 
     def to_panel(self):
         if self._panel is not None:
             return self._panel
+        if self._block is not None:
+            return self._block.to_panel()
 
         copies = {}
         for k,v in self.frames.items():
@@ -543,12 +1190,23 @@ class ColumnPanel(object):
     def iteritems(self):
         return iter(self.frames.items())
 
-    def downsample(self, freq, closed=None, label=None, axis=None):
+    def downsample(self, freq, closed=None, label=None, axis=None, drop_empty=True):
+        # goes through timeseries.downsample, so the bins are cached on the
+        # panel's major_axis
         panel = self.to_panel()
-        grouped = panel.downsample(freq=freq, closed=closed, label=label, axis=axis)
+        grouped = panel.downsample(freq=freq, closed=closed, label=label, axis=axis,
+                                   drop_empty=drop_empty)
         grouped = ColumnPanelGroupBy(grouped)
         return grouped
 
+    def fillforward(self, target=None):
+        """
+            fillforward every frame, sharing the target index and pad
+            indexer across frames with the same index.
+            See timeseries.fillforward_frames
+        """
+        return ColumnPanel(fillforward_frames(self.frames, target))
+
     def shift(self, *args, **kwargs):
         """ Replciate Panel.shift """
         panel = self.to_panel()
@@ -588,10 +1246,23 @@ class ColumnPanel(object):
     def __setstate__(self, d): 
         self.__dict__.update(d)
         self.__dict__['im'] = ColumnPanelItems(self)
+        self.__dict__['_cache'] = ColumnCache()
+        self.__dict__['_versions'] = OrderedDict()
 
-    def bundle_save(self, path, frame_key='frame_key'):
+    def bundle_save(self, path, frame_key='frame_key', format='columnar'):
         """ 
+        format : 'columnar' or 'obt'
+            columnar writes one (index x items) array per column, see
+            trtools.io.bundle.save_columnar. obt is the older OBTFile bundle.
+            A columnar save over an obt bundle leaves the OBTFile in place,
+            bundle_load reads the columnar fields first.
         """
+        if format == 'columnar':
+            items, index, fields = self._bundle_fields()
+            trio.save_columnar(path, items, index, fields)
+            self._dirty = False
+            return
+
         filepath = trio.bundle_filepath(path)
         store = trio.OBTFile(filepath, 'w', frame_key=frame_key, type='directory')
         try:
@@ -608,9 +1279,48 @@ class ColumnPanel(object):
         else:
             store.close()
 
+        # otherwise bundle_load still reads the old columnar fields
+        if trio.is_columnar(path):
+            trio.remove_columnar(path)
         self._dirty = False
 
-    def bundle_load(self, path):
+    def _bundle_fields(self):
+        """
+            (items, index, fields) where fields yields (column, index x items
+            array) one column at a time. Skips the column cache.
+        """
+        block = self._block
+        panel = self._panel
+        if block is None and panel is None and not self.aligned:
+            panel = self.to_panel()
+
+        if block is not None:
+            items, index = block.items, block.index
+        elif panel is not None:
+            items, index = panel.items, panel.major_axis
+        else:
+            items, index = pd.Index(self.items), self.index
+
+        def fields():
+            for col in list(self._columns):
+                if block is not None:
+                    values = block.column(col).values
+                elif panel is not None:
+                    values = panel.ix[:, :, col].values
+                else:
+                    values = np.column_stack([self.frames[k][col].values for k in items])
+                yield col, values
+        return items, index, fields()
+
+    def bundle_load(self, path, columns=None):
+        """
+            Columnar bundles load into block storage. columns only reads
+            those fields.
+        """
+        if trio.is_columnar(path):
+            items, index, fields = trio.load_columnar(path, columns)
+            return ColumnPanel(PanelBlocks.from_fields(items, index, fields))
+
         filepath = trio.bundle_filepath(path)
         store = trio.OBTFile(filepath)
         try:
@@ -622,6 +1332,177 @@ class ColumnPanel(object):
             store.close()
         self._dirty = False
 
+def _label_positions(index, keys):
+    """
+        index.get_indexer(keys) that raises KeyError on missing labels
+        instead of returning -1
+    """
+    index = pd.Index(index)
+    pos = index.get_indexer(keys)
+    if np.any(pos == -1):
+        missing = [key for key, p in zip(keys, pos) if p == -1]
+        raise KeyError("{0} not in index".format(missing))
+    return pos
+
+def _scalar_row_frame(frames):
+    """
+        One row frames to a DataFrame of columns x items
+    """
+    return DataFrame(OrderedDict((k, df.iloc[0]) for k, df in frames.items()))
+
+class LazyColumnPanel(object):
+    """
+        Lazy view of a ColumnPanel. Row, column and item selections are only
+        recorded, then applied in one go by collect: a single iloc per frame,
+        or one take on block storage.
+
+            cp.lazy().ix["2000"][['close', 'vol']].foreach(func)
+
+        Row selections resolve against the shared index like DataFrame.ix.
+        Anything else goes to the collected ColumnPanel.
+    """
+    def __init__(self, obj, rows=None, columns=None, items=None, row_keys=(),
+                 row_scalar=False):
+        self.obj = obj
+        # positions into obj.index
+        self.rows = rows
+        self.columns = columns
+        self.items = items
+        # original keys, for panels without a shared index
+        self.row_keys = row_keys
+        # a single row was picked, collect returns a DataFrame like ix
+        self.row_scalar = row_scalar
+
+    def _copy(self, **kwargs):
+        state = dict(rows=self.rows, columns=self.columns, items=self.items,
+                     row_keys=self.row_keys, row_scalar=self.row_scalar)
+        state.update(kwargs)
+        return LazyColumnPanel(self.obj, **state)
+
+    @property
+    def index(self):
+        index = self.obj.index
+        if self.rows is not None:
+            index = index[self.rows]
+        return index
+
+    @property
+    def ix(self):
+        return LazyIndexer(self)
+
+    def _select_rows(self, key):
+        row_keys = self.row_keys + (key,)
+        if not self.obj.aligned:
+            return self._copy(row_keys=row_keys)
+        # let Series.ix do the label resolution
+        index = self.index
+        pos = Series(np.arange(len(index)), index=index).ix[key]
+        row_scalar = np.ndim(pos) == 0
+        pos = np.atleast_1d(np.asarray(pos, dtype=np.int64))
+        if self.rows is not None:
+            pos = np.arange(len(self.obj.index))[self.rows][pos]
+        return self._copy(rows=pos, row_keys=row_keys, row_scalar=row_scalar)
+
+    def _select_columns(self, cols):
+        if isinstance(cols, slice):
+            return self
+        return self._copy(columns=list(cols))
+
+    def _select_items(self, items):
+        if isinstance(items, slice):
+            return self
+        current = self.items if self.items is not None else self.obj.items
+        # match on eq() and not hash, like _getitem_tuple
+        return self._copy(items=[key for key in current if key in items])
+
+    def __getitem__(self, key):
+        """
+            lazy[cols] or lazy[cols, items]. A single column name is
+            gathered right away.
+        """
+        if isinstance(key, tuple):
+            cols, items = key
+            return self._select_columns(_iter_or_slice(cols)) \
+                ._select_items(_iter_or_slice(items))
+        if isinstance(key, str):
+            return self._select_columns([key]).collect()[key]
+        return self._select_columns(_iter_or_slice(key))
+
+    def collect(self):
+        """
+            Apply the selections and return a ColumnPanel. A single row
+            returns a DataFrame of columns x items, like ColumnPanel.ix.
+            Raises KeyError for columns or items that don't exist.
+        """
+        obj = self.obj
+        items = self.items
+        if obj._block is not None:
+            item_pos = None
+            if items is not None:
+                item_pos = _label_positions(obj._block.items, items)
+            if self.columns is not None:
+                _label_positions(obj._block.columns, self.columns)
+            block = obj._block.take(item_pos, self.rows, self.columns)
+            cp = ColumnPanel(block, frame_wrapper=obj.frame_wrapper)
+            if self.row_scalar:
+                return _scalar_row_frame(cp.frames)
+            return cp
+
+        if items is None:
+            items = obj.items
+        else:
+            _label_positions(obj.items, items)
+        rows = _as_selector(self.rows, len(obj.index)) if obj.aligned else None
+        row_scalar = self.row_scalar
+        frames = OrderedDict()
+        for key in items:
+            df = obj.frames[key]
+            if rows is None:
+                for row_key in self.row_keys:
+                    df = df.ix[row_key]
+                if isinstance(df, Series):
+                    # single row, keep it as a frame until the end
+                    row_scalar = True
+                    df = DataFrame([df.values], index=[df.name], columns=df.index)
+            cols = slice(None)
+            if self.columns is not None:
+                cols = _label_positions(df.columns, self.columns)
+            if rows is not None:
+                df = df.iloc[rows, cols]
+            elif self.columns is not None:
+                df = df.iloc[:, cols]
+            frames[key] = df
+        if row_scalar:
+            return _scalar_row_frame(frames)
+        return ColumnPanel.from_frames(frames, frame_wrapper=obj.frame_wrapper)
+
+    def foreach(self, func, *args, **kwargs):
+        return self.collect().foreach(func, *args, **kwargs)
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        columns = self.columns if self.columns is not None else self.obj._columns
+        if key in columns:
+            return self[key]
+        return getattr(self.collect(), key)
+
+    def __repr__(self):
+        return 'Lazy' + repr(self.collect())
+
+class LazyIndexer(object):
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __getitem__(self, key):
+        """
+            ix[rows] or ix[rows, cols]
+        """
+        if isinstance(key, tuple):
+            rows, cols = key
+            return self.obj._select_rows(rows)._select_columns(_iter_or_slice(cols))
+        return self.obj._select_rows(key)
+
 # monkey
 @monkey.patch(Panel)
 def to_columnpanel(self):
@@ -10,6 +10,7 @@ from pandas.core.groupby import DataFrameGroupBy, PanelGroupBy, BinGrouper, Seri
 
 from trtools.monkey import patch, patch_prop
 from trtools.core.column_panel import PanelDict, ColumnPanel
+from trtools.core.binning import _bin_edges, _bin_reduce
 from trtools.tools.boxer import box_data
 
 class PanelGroupByMap(object):
@@ -37,8 +38,13 @@ class PanelGroupByMap(object):
         return mapper
 
     def apply(self, func, *args, **kwargs):
+        if func in PANEL_FAST_HOWS and not args and not kwargs:
+            res = _panel_fast_apply(self.obj, self.grouper, func, self.groupby.axis)
+            if res is not None:
+                return res
+
         result = OrderedDict()
-        for key, df in self.obj.items():
+        for key, df in self.obj.iteritems():
             grp = DataFrameGroupBy(df, grouper=self.grouper)
             f = func
             if not isinstance(func, collections.Callable):
@@ -61,6 +67,66 @@ class PanelGroupByMap(object):
         args.insert(0, func)
         return self.apply('apply', *args, **kwargs)
 
+# aggregations PanelGroupByMap.apply runs on the whole panel at once
+PANEL_FAST_HOWS = ['mean', 'sum', 'last', 'ohlc']
+
+_ohlc_hows = OrderedDict([('open', 'first'), ('high', 'max'), ('low', 'min'),
+                          ('close', 'last'), ('vol', 'sum')])
+
+def _panel_fast_apply(panel, grouper, how, axis=1):
+    """
+        Reduce the bins of every item in one pass over the stacked
+        (major x items * minor) values. Matches box_data of the per item
+        DataFrameGroupBy results. Returns None when the fast path doesn't
+        apply, i.e. non-bin groupers or non-numeric panels.
+    """
+    if not isinstance(grouper, BinGrouper) or not isinstance(panel, Panel):
+        return None
+    if axis != 1 or panel.values.dtype.kind not in 'iuf':
+        return None
+
+    starts, ends = _bin_edges(grouper)
+    labels = grouper.binlabels
+    values = panel.values
+    n_items, n_major, n_minor = values.shape
+
+    if how == 'ohlc':
+        minor = list(panel.minor_axis)
+        cols = [col for col in _ohlc_hows if col in minor]
+        if cols[:4] != ['open', 'high', 'low', 'close']:
+            return None
+        out = np.empty((n_items, len(ends), len(cols)))
+        for i, col in enumerate(cols):
+            vals = values[:, :, minor.index(col)].T.astype(float)
+            # bars_to_ohlc sums vol to 0 for bins that have no vol
+            out[:, :, i] = _panel_reduce(vals, starts, ends, _ohlc_hows[col],
+                                         nan_empty=col != 'vol').T
+        return Panel(out, items=panel.items, major_axis=labels, minor_axis=cols)
+
+    # bins along the major axis, items and minor flattened into columns
+    flat = values.transpose(1, 0, 2).reshape(n_major, -1).astype(float)
+    res = _panel_reduce(flat, starts, ends, how, nan_empty=True)
+    res = res.reshape(len(ends), n_items, n_minor).transpose(1, 0, 2)
+    return Panel(res, items=panel.items, major_axis=labels,
+                 minor_axis=panel.minor_axis)
+
+def _panel_reduce(vals, starts, ends, how, nan_empty):
+    """
+        _bin_reduce that leaves empty bins as nan. Without nan_empty, bins
+        without any values sum to 0 instead of nan.
+    """
+    out = np.empty((len(ends), vals.shape[1]))
+    out[:] = np.nan
+    nonempty = ends > starts
+    if not nonempty.any():
+        return out
+    starts = starts[nonempty]
+    res = _bin_reduce(vals, starts, ends[nonempty], how)
+    if how == 'sum' and not nan_empty:
+        res[np.isnan(res)] = 0
+    out[nonempty] = res
+    return out
+
 @patch_prop([PanelGroupBy], 'df_map')
 def df_map(self):
     return PanelGroupByMap(self)
@@ -105,52 +171,106 @@ def filter_by_grouped(grouped, by, obj=None):
         return filter_bingroup_index(grouped, index, obj)
     return filter_grouper_index(grouped, index, obj)
 
-def _reverse_flatten(mapping):
-    rev_map = dict()
-    for k, vals in mapping.items():
-        for v in vals:
-            rev_map[v] = k
-
-    return rev_map
-
 # TODO These are mixed. bingroup returns the original obj sans the bad groups
 # regular groupby returns a filtered groupby object
 def filter_grouper_index(grouped, index, obj):
+    keys = _filtered_keys(grouped, index)
+    if obj is not grouped.obj:
+        # different obj, map its labels through grouped.obj's
+        labels = grouped.obj._get_axis(grouped.axis)
+        keys = _remap_keys(labels, keys, obj._get_axis(grouped.axis))
+    return obj.groupby(keys, axis=grouped.axis)
+
+def _filtered_keys(grouped, index):
+    """
+        Group label for every row of grouped.obj, nan for rows whose group
+        isn't in index. Built off group_info, so no per group dict.
+    """
+    grouper = grouped.grouper
+    comp_ids, _, ngroups = grouper.group_info
+    labels = grouper.result_index
+    keep = np.asarray(labels.isin(index), dtype=bool)
+
+    ids = comp_ids.clip(0, None)
+    drop = (comp_ids < 0)
+    if ngroups:
+        drop |= ~keep.take(ids)
+        keys = np.asarray(labels.values).take(ids)
+    else:
+        keys = np.empty(len(comp_ids), dtype=object)
+    return _null_keys(keys, drop)
 
-    old_groups = grouped.groups
-    groups = {k:v for k, v in old_groups.items() if k in index}
-    rmap = _reverse_flatten(groups)
+def _null_keys(keys, drop):
+    if keys.dtype.kind == 'M':
+        keys[drop] = np.datetime64('NaT')
+    else:
+        keys = keys.astype(object)
+        keys[drop] = np.nan
+    return keys
 
-    return obj.groupby(rmap)
+def _remap_keys(labels, keys, target):
+    """
+        keys lined up with target, looking each target label up in labels.
+        Labels are matched with get_indexer, no label -> group dict. A
+        label that repeats in labels takes the key of its last row with a
+        kept group. Labels missing from labels get nan.
+    """
+    if labels.is_unique:
+        rows = np.arange(len(labels))
+        uniques = labels
+    else:
+        uniques = pd.Index(labels.unique())
+        codes = uniques.get_indexer(labels)
+        kept = ~pd.isnull(keys)
+        # grouped by label, kept rows after dropped ones, last row wins
+        order = np.lexsort((np.arange(len(codes)), kept, codes))
+        sorted_codes = codes.take(order)
+        last = np.r_[sorted_codes[1:] != sorted_codes[:-1], True]
+        rows = np.empty(len(uniques), dtype=np.int64)
+        rows[sorted_codes[last]] = order[last]
+
+    locs = uniques.get_indexer(target)
+    hit = locs != -1
+    result = np.empty(len(locs), dtype=keys.dtype)
+    result[hit] = keys.take(rows.take(locs[hit]))
+    return _null_keys(result, ~hit)
 
 def filter_bingroup_index(grouped, index, obj):
+    """
+        obj without the bins not in index. The kept bins are turned into
+        row positions with np.repeat and taken in one go.
+    """
     # http://stackoverflow.com/questions/13446480/python-pandas-remove-entries-based-on-the-number-of-occurrences
     # I think that overrides what i was doing...
-    groups = list(_bingroup_groups(grouped))
-    groups = collections.OrderedDict(groups)
-
-    filtered_groups = [(i, groups[i]) for i in index]
-    parts = []
-    for i, slc in filtered_groups:
-        # TODO: concat blocks instead of DataFrames, faster
-        #bit = obj._data.get_slice(slice(slc[0], slc[1]), 1)
-        bit = obj[slc[0]:slc[1]]
-        parts.append(bit)
-
-    res = pd.concat(parts)
-    return res
-
-def _bingroup_groups(grouped):
+    starts, ends, labels = _bingroup_edges(grouped)
+    locs = labels.get_indexer(index)
+    if np.any(locs == -1):
+        missing = np.asarray(index)[locs == -1]
+        raise KeyError("{0} not in groups".format(missing))
+
+    starts = starts.take(locs)
+    lengths = ends.take(locs) - starts
+    # start of each kept bin in the output
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return obj.take(positions, axis=grouped.axis)
+
+def _bingroup_edges(grouped):
+    """
+        (starts, ends, labels) of every bin. Rows past the last bin edge go
+        to the last label, replacing its bin like the old OrderedDict did.
+    """
     grouper = grouped.grouper
-    data = grouped.obj
-
-    start = 0
-    for edge, label in zip(grouper.bins, grouper.binlabels):
-        yield label, (start, edge)
-        start = edge
+    length = grouped.obj._get_axis(grouped.axis).size
 
-    if edge < len(data):
-        yield grouper.binlabels[-1], (edge, len(data))
+    ends = np.asarray(grouper.bins, dtype=np.int64)
+    starts = np.r_[0, ends[:-1]].astype(np.int64)
+    labels = grouper.binlabels
+    if len(ends) and ends[-1] < length:
+        starts[-1] = ends[-1]
+        ends = ends.copy()
+        ends[-1] = length
+    return starts, ends, labels
 
 @patch([PanelGroupBy, DataFrameGroupBy], 'filter_grouped')
 def filter_grouped_monkey(self, by):
@@ -171,7 +291,7 @@ def panel_process(self, func, *args, **kwargs):
     start = 0
     for i, x in enumerate(bins):
         label = binlabels[i]
-        sub = self.obj.ix._getitem_axis(slice(start, x), axis=axis)
+        sub = _bin_subset(self.obj, start, x, axis)
         res = func(sub)
         parts[label] = res
         start = x
@@ -228,7 +348,16 @@ def subset(self, key):
 
     end = bins[loc]
     axis = self.axis
-    return self.obj.ix._getitem_axis(slice(start, end), axis=axis)
+    return _bin_subset(self.obj, start, end, axis)
+
+def _bin_subset(obj, start, end, axis):
+    """
+        Positions start:end along axis. A row slice for DataFrames, so the
+        subset is a view.
+    """
+    slicer = [slice(None)] * obj.ndim
+    slicer[axis] = slice(start, end)
+    return obj.iloc[tuple(slicer)]
 
 if __name__ == '__main__':
     ind =  pd.date_range(start="1990-01-01", freq="H", periods=10000)
@@ -10,6 +10,10 @@ imp.reload(binning)
 
 zscore = lambda x: (x - x.mean()) / x.std()
 
+def zscore_frame(x):
+    # module level so the process backend can pickle it
+    return (x - x.mean()) / x.std()
+
 class TestBinning(TestCase):
 
     def __init__(self, *args, **kwargs):
@@ -36,6 +40,161 @@ class TestBinning(TestCase):
         assert len(topen.columns) == 1
         tm.assert_series_equal(t2['open'], topen['open'])
 
+    def test_group_view(self):
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=100)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)), 
+                           'close': np.random.randn(len(ind))}, index=ind)
+        view = binning.GroupView(df)
+
+        view.bind(10, 20)
+        assert len(view) == 10
+        tm.assert_almost_equal(view['open'], df.open.values[10:20])
+        # zero-copy
+        assert view.close.base is not None
+        tm.assert_frame_equal(view.frame(), df[10:20])
+        assert np.may_share_memory(view.frame().values, df.values)
+
+        # rebind
+        view.bind(50, 60)
+        tm.assert_frame_equal(view.frame(), df[50:60])
+        tm.assert_series_equal(view.series('close'), df.close[50:60])
+
+    def test_apply_put_raw(self):
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=1000)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)), 
+                           'close': np.random.randn(len(ind))}, index=ind)
+        grouper = df.downsample('D').grouper
+
+        # numpy std defaults to ddof=0, so stick to mean
+        demean = lambda x: x - x.mean()
+        correct = binning.apply_put(df, grouper, {'open':demean})
+        test = binning.apply_put(df, grouper, {'open':demean}, raw=True)
+        tm.assert_frame_equal(test, correct)
+
+    def test_apply_put_fast(self):
+        """
+        reductions passed by name skip the per-bin func call but should 
+        match calling the func for each bin
+        """
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=1000)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)), 
+                           'close': np.random.randn(len(ind))}, index=ind)
+        df['open'][df.open > 1] = np.nan
+        grouper = df.downsample('D').grouper
+
+        funcs = {
+            'mean': lambda x: x.mean(),
+            'sum': lambda x: x.sum(),
+            'max': lambda x: x.max(),
+            'min': lambda x: x.min(),
+            'first': lambda x: x.dropna().iloc[0],
+            'last': lambda x: x.dropna().iloc[-1],
+            'cumsum': lambda x: x.cumsum(),
+        }
+        for how, func in funcs.items():
+            correct = binning.apply_put_frame(df, grouper, {'open':func, 'close':func})
+            test = binning.apply_put(df, grouper, how)
+            tm.assert_frame_equal(test[['open', 'close']], correct)
+
+            test = binning.apply_put(df.close, grouper, how)
+            tm.assert_series_equal(test, correct['close'])
+
+        test = binning.apply_put(df.close, grouper, np.maximum)
+        correct = binning.apply_put(df.close, grouper, 'max')
+        tm.assert_series_equal(test, correct)
+
+    def test_apply_put_fast_nan(self):
+        """
+        all nan bins sum to nan on the fast path like the per bin sum,
+        np.nansum gives 0. Non numeric columns go through pandas.
+        """
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=1000)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)),
+                           'name': ['abc'] * len(ind)}, index=ind)
+        grouper = df.downsample('D').grouper
+        df.open[:grouper.bins[0]] = np.nan
+
+        correct = binning.apply_put_frame(df[['open']], grouper,
+                                          {'open': lambda x: x.sum()})
+        test = binning.apply_put(df.open, grouper, 'sum')
+        assert np.all(np.isnan(test[:grouper.bins[0]]))
+        tm.assert_series_equal(test, correct['open'])
+
+        # np.nansum isn't the 'sum' fast path, all nan bins stay 0
+        test = binning.apply_put(df.open, grouper, np.nansum)
+        assert np.all(test[:grouper.bins[0]] == 0)
+        correct = binning.apply_put_frame(df[['open']], grouper,
+                                          {'open': lambda x: np.nansum(x)})
+        tm.assert_series_equal(test, correct['open'])
+
+        test = binning.apply_put(df, grouper, 'last')
+        assert test['name'].dtype == object
+        assert np.all(test['name'] == 'abc')
+        correct = binning.apply_put(df.open, grouper, 'last')
+        tm.assert_series_equal(test['open'], correct)
+
+    def test_apply_put_n_jobs(self):
+        """
+        parallel output should be identical to serial
+        """
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=5000)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)), 
+                           'close': np.random.randn(len(ind))}, index=ind)
+        grouper = df.downsample('D').grouper
+
+        correct = binning.apply_put(df, grouper, zscore_frame)
+        for backend in ['thread', 'process']:
+            test = binning.apply_put(df, grouper, zscore_frame, n_jobs=3, backend=backend)
+            tm.assert_frame_equal(test, correct)
+
+            test = binning.apply_put(df.open, grouper, zscore_frame, n_jobs=3, backend=backend)
+            tm.assert_series_equal(test, correct.open)
+
+    def test_apply_put_grouper(self):
+        """
+        apply_put on a non-bin grouper should match groupby.transform
+        """
+        df = pd.DataFrame({'open': np.random.randn(1000), 
+                           'close': np.random.randn(1000)})
+        sector = np.random.choice(['tech', 'energy', 'retail'], len(df))
+        grouped = df.groupby(sector)
+
+        test = grouped.apply_put(zscore)
+        correct = grouped.transform(zscore)
+        tm.assert_frame_equal(test, correct)
+
+        test = grouped['open'].apply_put('mean')
+        correct = grouped['open'].transform(np.mean)
+        tm.assert_series_equal(test, correct)
+
+    def test_topn_grouped(self):
+        """
+        DataFrame groupby topn ranks each column within the group, not
+        across columns like DataFrame.topn
+        """
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="12H", periods=4)
+        df = pd.DataFrame({'a': [1, 5, 2, 3], 'b': [9, 0, 7, 8]}, index=ind,
+                          columns=['a', 'b'])
+        test = df.downsample('D').topn(1)
+        assert list(test['a']) == [5, 3]
+        assert list(test['b']) == [9, 8]
+
+        ind = pd.DatetimeIndex(start="2000-01-01", freq="5min", periods=1000)
+        df = pd.DataFrame({'open': np.random.randn(len(ind)), 
+                           'close': np.random.randn(len(ind))}, index=ind)
+        grouped = df.downsample('D')
+
+        test = grouped.topn(3)
+        for label, group in grouped:
+            for col in df.columns:
+                correct = group[col].topn(3)
+                tm.assert_almost_equal(test[col].ix[label].values, correct.values)
+
+        test = grouped['open'].topn(-3)
+        for label, group in grouped:
+            correct = group['open'].topn(-3)
+            tm.assert_almost_equal(test.ix[label].values, correct.values)
+
 
 if __name__ == '__main__':                                                                                          
     import nose                                                                      
@@ -1,10 +1,12 @@
 from unittest import TestCase
 import collections
+import os
 
 import pandas as pd
 import numpy as np
 
 import trtools.util.testing as tm
+import trtools.io.api as trio
 import trtools.core.column_panel as column_panel
 ColumnPanel = column_panel.ColumnPanel
 ColumnPanelMapper = column_panel.ColumnPanelMapper
@@ -15,6 +17,10 @@ import trtools.tools.tile # .tile monkey patch
 
 from trtools.util.tempdir import TemporaryDirectory
 
+def _cross_signal(df, window):
+    # module level so the process backend can pickle it
+    return pd.rolling_mean(df.close, window) > df.close
+
 
 class TestColumnPanel(TestCase):
 
@@ -90,12 +96,50 @@ class TestColumnPanel(TestCase):
         data['INTC'] = tm.fake_ohlc(N).head(100)
         cp = ColumnPanel(data)
 
-        with TemporaryDirectory() as td:
-            path = td + 'TEST.columnpanel'
-            cp.bundle_save(path)
+        for format in ['columnar', 'obt']:
+            with TemporaryDirectory() as td:
+                path = td + 'TEST.columnpanel'
+                cp.bundle_save(path, format=format)
 
+                loaded = cp.bundle_load(path)
+                tm.assert_columnpanel_equal(cp, loaded)
+
+        # obt over a columnar bundle loads the obt data
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'TEST.columnpanel')
+            cp.bundle_save(path, format='columnar')
+            cp2 = ColumnPanel(data)
+            cp2['double'] = cp2.close * 2
+            cp2.bundle_save(path, format='obt')
+            assert not trio.is_columnar(path)
             loaded = cp.bundle_load(path)
-            tm.assert_columnpanel_equal(cp, loaded)
+            tm.assert_columnpanel_equal(cp2, loaded)
+
+    def test_bundle_columnar(self):
+        """
+            Columnar bundles from each storage mode, and loading a subset
+        """
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N)
+        data['AMD'] = tm.fake_ohlc(N)
+        for storage in ['frames', 'block']:
+            cp = ColumnPanel(data, storage=storage)
+            # force frames mode off the panel
+            cp.frames
+            with TemporaryDirectory() as td:
+                path = os.path.join(td, 'TEST.columnpanel')
+                cp.bundle_save(path)
+
+                loaded = cp.bundle_load(path)
+                assert loaded.items == cp.items
+                assert list(loaded.columns) == list(cp.columns)
+                for col in cp.columns:
+                    tm.assert_frame_equal(loaded[col], cp[col])
+
+                loaded = cp.bundle_load(path, columns=['close'])
+                assert list(loaded.columns) == ['close']
+                tm.assert_frame_equal(loaded.close, cp.close)
 
     def test_df_ix_single(self):
         """
@@ -159,6 +203,190 @@ class TestColumnPanel(TestCase):
         df2 = test.im['df2']
         assert np.all(df2.count() == 1), 'df2 has only one non-na row'
 
+    def test_fillforward(self):
+        ind = pd.date_range(start="2000-01-07", freq="W-FRI", periods=10)
+        df = pd.DataFrame({'test':np.arange(10.)}, index=ind)
+        cp = column_panel.ColumnPanel({'df1':df, 'df2':df * 2})
+        test = cp.fillforward()
+        tm.assert_frame_equal(test.im['df1'], df.fillforward())
+        tm.assert_frame_equal(test.im['df2'], (df * 2).fillforward())
+
+    def test_block_storage(self):
+        """
+        block backed ColumnPanel should match the frames version, with
+        columns as views into the block
+        """
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N)
+        data['AMD'] = tm.fake_ohlc(N)
+        data['INTC'] = tm.fake_ohlc(N).tail(500)
+        cp = ColumnPanel(data)
+        bcp = ColumnPanel(data, storage='block')
+
+        assert bcp.items == cp.items
+        assert bcp.columns.equals(cp.columns)
+        assert bcp.index.equals(cp.frames['AAPL'].index)
+        tm.assert_frame_equal(bcp.close, cp.close)
+
+        # int vol is upcast like the Panel does, so there's one block
+        assert list(bcp._block.blocks) == [np.dtype(float)]
+        block = bcp._block.blocks[np.dtype(float)]
+        assert np.may_share_memory(bcp.close.values, block)
+        # frames are built per key, as views
+        assert bcp.frames.built() == []
+        assert np.may_share_memory(bcp.frames['AMD'].values, block)
+        assert bcp.frames.built() == ['AMD']
+        tm.assert_frame_equal(bcp.frames['AMD'], cp.frames['AMD'])
+
+        # new column
+        bcp['up'] = bcp.close > bcp.open
+        cp['up'] = cp.close > cp.open
+        tm.assert_frame_equal(bcp.up, cp.up)
+        assert list(bcp.columns) == list(cp.columns)
+        tm.assert_frame_equal(bcp.frames['AAPL'], cp.frames['AAPL'])
+        tm.assert_panel_equal(bcp.to_panel(), cp.to_panel())
+
+    def test_column_cache(self):
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N)
+        data['AMD'] = tm.fake_ohlc(N)
+        cp = ColumnPanel(data)
+
+        close = cp.close
+        assert cp.close is close
+        assert cp.cache_info()['hits'] == 1
+
+        # adding a column keeps the other cached columns
+        cp['double'] = close * 2
+        close = cp.close
+        assert cp.close is close
+        tm.assert_frame_equal(cp.double, close * 2)
+
+        # replacing a frame invalidates
+        df = cp.frames['AAPL'].copy()
+        df['close'] = 1
+        cp.frames['AAPL'] = df
+        assert np.all(cp.close['AAPL'] == 1)
+
+        # in place edits through frames[key] are seen
+        cp.frames['AMD'].ix[:, 'close'] = 2
+        assert np.all(cp.close['AMD'] == 2)
+        cp.frames['AMD']['close'] = 3
+        assert np.all(cp.close['AMD'] == 3)
+
+        # a frame held past a read needs a touch
+        amd = cp.frames['AMD']
+        close = cp.close
+        amd.ix[:, 'close'] = 4
+        assert cp.close is close
+        cp.touch('AMD')
+        assert np.all(cp.close['AMD'] == 4)
+
+        # replacing the same frame again still invalidates
+        for val in [3, 4, 5]:
+            df = cp.frames['AAPL'].copy()
+            df['close'] = val
+            cp.frames['AAPL'] = df
+            assert np.all(cp.close['AAPL'] == val)
+
+    def test_column_cache_lru(self):
+        """
+        Going past maxbytes evicts the least recently used column
+        """
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N)
+        data['AMD'] = tm.fake_ohlc(N)
+        cp = ColumnPanel(data)
+        cp.frames
+
+        cache = cp._cache
+        cache.maxbytes = cp.close.values.nbytes * 2
+        cp.open
+        assert 'close' in cache and 'open' in cache
+        # close is now the most recently used
+        close = cp.close
+        cp.high
+        assert 'open' not in cache
+        assert 'close' in cache
+        assert 'high' in cache
+        assert cp.close is close
+        assert cache.nbytes <= cache.maxbytes
+
+    def test_foreach_n_jobs(self):
+        N = 500
+        data = dict(('SYM%d' % i, tm.fake_ohlc(N)) for i in range(9))
+        for storage in ['frames', 'block']:
+            cp = ColumnPanel(data, storage=storage)
+            correct = cp.foreach(_cross_signal, 10)
+            test = cp.foreach(_cross_signal, 10, n_jobs=3)
+            tm.assert_frame_equal(test, correct)
+            test = cp.foreach(_cross_signal, 10, n_jobs=2, backend='process', chunksize=2)
+            tm.assert_frame_equal(test, correct)
+
+    def test_index_aligned(self):
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N)
+        data['AMD'] = tm.fake_ohlc(N)
+        cp = ColumnPanel(data)
+        index = cp.index
+        assert cp.aligned
+        assert cp.index is index
+
+        # frames mode, equal but not identical indexes
+        cp.frames['AAPL'] = data['AAPL'].copy()
+        cp.frames['AAPL'].index = pd.DatetimeIndex(data['AAPL'].index.asi8)
+        assert cp.aligned
+        assert cp.index.equals(index)
+
+        cp.frames['AMD'] = data['AMD'].tail(10)
+        assert not cp.aligned
+        self.assertRaises(Exception, lambda: cp.index)
+
+        cp.frames['AMD'] = data['AMD']
+        assert cp.aligned
+        cp['double'] = cp.close * 2
+        tm.assert_frame_equal(cp.double, cp.close * 2)
+
+    def test_lazy(self):
+        """
+        lazy selections should match the eager chain
+        """
+        N = 1000
+        data = {}
+        data['AAPL'] = tm.fake_ohlc(N, freq="D")
+        data['AMD'] = tm.fake_ohlc(N, freq="D")
+        data['INTC'] = tm.fake_ohlc(N, freq="D")
+        for storage in ['frames', 'block']:
+            cp = ColumnPanel(data, storage=storage)
+            correct = cp.ix["2000-02":"2000-05"][['close', 'vol'], ['AAPL', 'INTC']]
+            lazy = cp.lazy().ix["2000-02":"2000-05"][['close', 'vol'], ['AAPL', 'INTC']]
+            test = lazy.collect()
+            assert test.items == correct.items
+            assert list(test.columns) == list(correct.columns)
+            for key in correct.items:
+                tm.assert_frame_equal(test.frames[key], correct.frames[key])
+
+            # chained row selections compose
+            test = cp.lazy().ix["2000"].ix["2000-03"].close
+            tm.assert_frame_equal(test, cp.ix["2000-03"].close)
+
+            # missing labels raise instead of picking the wrong column
+            lazy = cp.lazy()[['close', 'bogus']]
+            self.assertRaises(KeyError, lazy.collect)
+            lazy = cp.lazy()[:, ['AAPL', 'INTC']]
+            lazy.items.append('BOGUS')
+            self.assertRaises(KeyError, lazy.collect)
+
+            # a single row gives the same DataFrame as ix
+            label = cp.index[10]
+            tm.assert_frame_equal(cp.lazy().ix[label].collect(), cp.ix[label])
+            test = cp.lazy().ix[label, ['close', 'vol']].collect()
+            tm.assert_frame_equal(test, cp.ix[label, ['close', 'vol']])
+
 
 if __name__ == '__main__':                                                                                          
     import nose                                                                      
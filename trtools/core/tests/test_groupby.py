@@ -1,5 +1,9 @@
 from unittest import TestCase
 
+import pandas as pd
+import numpy as np
+
+import trtools.util.testing as tm
 import trtools.core.groupby as groupby
 
 class TestGroupBy(TestCase):
@@ -16,6 +20,79 @@ class TestGroupBy(TestCase):
     def test_method(self):
         pass
 
+    def test_df_map_fast(self):
+        """
+        whole panel aggregations should match the per item groupby
+        """
+        data = {}
+        for i in range(4):
+            df = tm.fake_ohlc(2000, freq="5min")
+            df.ix[df.index[100:400], 'close'] = np.nan
+            data['item%d' % i] = df
+        panel = pd.Panel(data)
+        grouped = panel.downsample('D')
+
+        for how in groupby.PANEL_FAST_HOWS:
+            test = getattr(grouped.df_map, how)()
+            correct = pd.Panel(dict((k, getattr(df.downsample('D'), how)())
+                                    for k, df in panel.iteritems()))
+            tm.assert_panel_equal(test, correct)
+
+    def test_subset(self):
+        """
+        subset/process hand out positional slices along the group axis
+        """
+        df = tm.fake_ohlc(2000, freq="5min")
+        grouped = df.downsample('D')
+        bins = grouped.grouper.bins
+        label = grouped.grouper.binlabels[1]
+        test = grouped.subset(label)
+        tm.assert_frame_equal(test, df.iloc[bins[0]:bins[1]])
+        assert np.may_share_memory(test.close.values, df.close.values)
+
+        panel = pd.Panel({'AAPL': df, 'AMD': df * 2})
+        grouped = panel.downsample('D')
+        test = grouped.subset(label)
+        tm.assert_panel_equal(test, panel.iloc[:, bins[0]:bins[1]])
+        test = grouped.process(lambda x: x.shape[1])
+        assert list(test.values) == list(np.diff(np.r_[0, bins]))
+
+    def test_filter_grouped(self):
+        """
+        filtering should match slicing out the kept groups by hand
+        """
+        ind = pd.date_range(start="1990-01-01", freq="H", periods=1000)
+        df = pd.DataFrame({'high': list(range(len(ind))),
+                           'open': np.random.randn(len(ind))}, index=ind)
+
+        # bin grouper
+        grouped = df.downsample('D', closed="left")
+        pos = grouped['open'].mean() > 0
+        test = groupby.filter_by_grouped(grouped, pos)
+        parts = [df.ix[str(day.date())] for day in pos[pos].index]
+        tm.assert_frame_equal(test, pd.concat(parts))
+
+        # regular grouper
+        grouped = df.groupby(lambda x: x.date())
+        pos = grouped['open'].mean() > 0
+        test = groupby.filter_by_grouped(grouped, pos).sum()
+        correct = grouped.sum()[pos]
+        tm.assert_frame_equal(test, correct)
+
+        # different obj is mapped through grouped.obj's labels
+        sub = df.iloc[::3]
+        test = groupby.filter_by_grouped(grouped, pos, obj=sub).sum()
+        correct = sub.groupby(lambda x: x.date()).sum()[pos]
+        tm.assert_frame_equal(test, correct)
+
+        # obj with a duplicated label goes through the label mapping
+        dup = df.append(df.iloc[[5]]).sort_index()
+        grouped = dup.groupby(lambda x: x.date())
+        pos = grouped['open'].mean() > 0
+        test = groupby.filter_by_grouped(grouped, pos, obj=dup.copy()).sum()
+        correct = grouped.sum()[pos]
+        tm.assert_frame_equal(test, correct)
+
 if __name__ == '__main__':                                                                                          
     import nose                                                                      
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)   
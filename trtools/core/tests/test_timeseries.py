@@ -1,4 +1,6 @@
 from unittest import TestCase
+from datetime import datetime, time
+import gc
 
 import pandas as pd
 from pandas.core.groupby import BinGrouper
@@ -6,6 +8,7 @@ import trtools.util.testing as tm
 import numpy as np
 
 import trtools.core.timeseries as ts
+from pandas.tseries.frequencies import to_offset
 
 # start on friday, so second day is saturday
 df = tm.fake_ohlc(1000000, freq="5min", start="2000-01-07")
@@ -41,6 +44,276 @@ class TestBinning(TestCase):
         correct = df.resample('D', how='mean').dropna(how='all')
         tm.assert_frame_equal(test, correct)
 
+    def test_time_bins(self):
+        """
+        time_bins should match the bins from a TimeGrouper groupby
+        """
+        from pandas.tseries.resample import TimeGrouper
+        for freq in ['30min', 'H', 'D', 'W', 'MS']:
+            defaults = ts._offset_defaults(freq)
+            for closed in ['left', 'right']:
+                tg = TimeGrouper(freq, closed=closed, label=defaults['label'])
+                correct = df.groupby(tg).grouper
+                bins, labels = ts.time_bins(df.index, to_offset(freq), closed,
+                                            defaults['label'])
+                tm.assert_almost_equal(bins, correct.bins)
+                assert labels.equals(correct.binlabels)
+
+    def test_bin_cache(self):
+        """
+        downsampling frames that share an index should reuse the grouper
+        """
+        ts.bin_cache.clear()
+        other = df.close.to_frame()
+        grouped = df.downsample('D')
+        assert ts.bin_cache.misses == 1
+        test = other.downsample('D')
+        assert ts.bin_cache.hits == 1
+        assert test.grouper is grouped.grouper
+        tm.assert_frame_equal(test.mean(), grouped.mean()[['close']])
+
+        # different params are a different entry
+        df.downsample('D', drop_empty=False)
+        assert ts.bin_cache.misses == 2
+
+        # new index is a miss, even if equal
+        new_index = pd.DatetimeIndex(df.index.values)
+        pd.DataFrame(df.values, index=new_index, columns=df.columns).downsample('D')
+        assert ts.bin_cache.misses == 3
+
+        # lru
+        cache = ts.BinCache(maxsize=2)
+        index = df.index
+        cache.set(index, 1, 'one')
+        cache.set(index, 2, 'two')
+        cache.get(index, 1)
+        cache.set(index, 3, 'three')
+        assert cache.get(index, 2) is None
+        assert cache.get(index, 1) == 'one'
+
+        # entries go away with their index
+        cache = ts.BinCache()
+        index = pd.DatetimeIndex(df.index.values)
+        cache.set(index, 1, 'one')
+        cache.set(df.index, 1, 'other')
+        assert len(cache) == 2
+        del index
+        gc.collect()
+        assert len(cache) == 1
+        assert cache.get(df.index, 1) == 'other'
+
+    def test_kv_agg(self):
+        """
+        vectorized argmax/argmin should match picking per group
+        """
+        grouped = df.downsample('D')
+        for func, pick in [(np.argmax, 'idxmax'), (np.argmin, 'idxmin')]:
+            test = ts.kv_agg(grouped, func, col='high')
+            labels = [getattr(group.high, pick)() for key, group in grouped]
+            assert np.all(test.index == pd.DatetimeIndex(labels))
+            tm.assert_almost_equal(test.values, df.high[labels].values)
+
+        test = ts.max_groupby(grouped, 'high')
+        tm.assert_almost_equal(test.values, grouped.high.max().values)
+
+        # _kv_agg takes the same path, check it against picking per group
+        for func in [np.argmax, np.argmin]:
+            test = ts._kv_agg(grouped, func, col='high')
+            index = []
+            values = []
+            for key, group in grouped:
+                pos = func(group.high.values)
+                index.append(group.index[pos])
+                values.append(group.high.values[pos])
+            tm.assert_series_equal(test, pd.Series(values, index=index))
+            tm.assert_series_equal(test, ts.kv_agg(grouped, func, col='high'))
+
+    def test_ohlc(self):
+        """
+        single pass ohlc should match the cython agg version
+        """
+        grouped = df.downsample('D')
+        test = grouped.ohlc()
+        correct = ts.ohlc_grouped_cython(grouped)
+        tm.assert_frame_equal(test, correct, check_dtype=False)
+
+    def test_ticks_to_ohlc(self):
+        ticks = pd.DataFrame({'price': df.close, 'vol': df.vol})
+        grouped = ticks.downsample('D')
+        test = grouped.ohlc(price='price', vwap=True, count=True)
+
+        assert np.all(test.columns == ['open', 'high', 'low', 'close', 'vol', 'vwap', 'count'])
+        tm.assert_series_equal(test.open, grouped.price.first(), check_names=False)
+        tm.assert_series_equal(test.high, grouped.price.max(), check_names=False)
+        tm.assert_series_equal(test.low, grouped.price.min(), check_names=False)
+        tm.assert_series_equal(test.close, grouped.price.last(), check_names=False)
+        tm.assert_almost_equal(test.vol.values, grouped.vol.sum().values)
+        tm.assert_almost_equal(test['count'].values, grouped.price.count().values)
+
+        vwap = grouped.apply(lambda x: (x.price * x.vol).sum() / x.vol.sum())
+        tm.assert_almost_equal(test.vwap.values, vwap.values)
+
+    def test_time_of_day(self):
+        """
+        int64 versions should match looping over datetimes
+        """
+        index = df.index[:10000]
+        tm.assert_almost_equal(ts.hours(index), [d.hour for d in index])
+        tm.assert_almost_equal(ts.minutes(index), [d.minute for d in index])
+        assert np.all(ts.times(index) == np.array([d.time() for d in index]))
+        assert np.all(index.time == np.array([d.time() for d in index]))
+
+        s = pd.Series(1, index=index)
+        test = ts.time_slice(s, 10, 30)
+        correct = np.array([d.time() == time(10, 30) for d in index])
+        assert np.all(test == correct)
+        test = ts.time_slice(s, hour=10)
+        assert np.all(test == np.array([d.hour == 10 for d in index]))
+        test = ts.time_slice(s, minute=15)
+        assert np.all(test == np.array([d.minute == 15 for d in index]))
+
+        test = ts.set_time(index, 16, 0)
+        correct = [datetime.combine(d.date(), time(16)) for d in index]
+        assert np.all(test == pd.DatetimeIndex(correct))
+
+    def test_session_calendar(self):
+        """
+        in_session should match trading_hours, minus holidays and the
+        early close on half days
+        """
+        index = df.index[:5000]
+        start, end = index[0], index[-1]
+        days = pd.DatetimeIndex(np.unique(index.normalize().asi8))
+        holiday = days[2].date()
+        half_day = days[3].date()
+
+        cal = ts.SessionCalendar(start, end, holidays=[holiday],
+                                 half_days={half_day: time(13)})
+        test = cal.in_session(index)
+        dates = index.date
+        correct = (dates != holiday) & ~((dates == half_day) & (index.time > time(13)))
+        assert np.all(test == correct)
+        assert np.all(cal.session_ids(index)[~test] == -1)
+
+        # asof to session open
+        opens = cal.asof(index[test])
+        assert np.all(opens == ts.set_time(index[test], 9, 30))
+        assert pd.isnull(cal.asof(index[~test])).all()
+
+        # same thing loaded from a file
+        import tempfile, os
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write("# holidays\n{0}\n{1} 13:00\n".format(holiday, half_day))
+        fcal = ts.SessionCalendar.from_file(path, start, end)
+        os.remove(path)
+        tm.assert_almost_equal(fcal.closes, cal.closes)
+
+        # daily and intraday bins off the calendar
+        sess = ts.trading_hours(df[:5000], calendar=cal)
+        test = sess.downsample('D', calendar=cal).close.last()
+        correct = sess.close.groupby(sess.index.date).last()
+        tm.assert_almost_equal(test.values, correct.values)
+        assert np.all(test.index.date == correct.index)
+
+        test = ts.anchor_downsample(sess, '30min', calendar=cal).close.last()
+        correct = sess.close.downsample('30min').last()
+        tm.assert_almost_equal(test.values, correct.values)
+        assert np.all(ts.time_of_day(test.index) % (30 * ts.NS_PER_MINUTE) == 0)
+
+        # intraday onto the sessions, each session takes its own last value
+        test = sess.close.fillforward(cal)
+        assert test.index.equals(cal.sessions)
+        correct = sess.close.groupby(sess.index.date).last()
+        days = pd.DatetimeIndex([datetime.combine(d, time(0)) for d in correct.index])
+        tm.assert_almost_equal(test.reindex(days).values, correct.values)
+        test = ts.fillforward_frames({'a': sess[['close']]}, cal)['a']
+        tm.assert_frame_equal(test, sess[['close']].fillforward(cal))
+
+        # calendar bins are fixed, other bin options raise
+        for kwargs in [dict(closed='left'), dict(label='left'), dict(drop_empty=False)]:
+            self.assertRaises(ValueError, sess.downsample, 'D', calendar=cal, **kwargs)
+
+    def test_time_index_asof(self):
+        ind = ts.get_time_index('15min')
+        index = pd.date_range('2000-01-03 08:00', '2000-01-04 18:00', freq='7min')
+        test = ind.asof(index)
+        for date, res in zip(index, test):
+            if date.time() < time(9, 30):
+                assert res == date
+                continue
+            correct = [t for t in ind.times if t <= date.time()][-1]
+            assert res == datetime.combine(date.date(), correct)
+        assert ind.asof(index[50]) == test[50]
+
+    def test_daily_group(self):
+        sub = df[:5000]
+        test = ts.daily_group(sub).close.sum()
+        correct = sub.close.groupby(sub.index.date).sum()
+        tm.assert_almost_equal(test.values, correct.values)
+
+        grouped = ts.weekly_group(sub)
+        test = grouped.close.sum()
+        correct = sub.close.groupby(grouped._range.asof).sum()
+        tm.assert_almost_equal(test.values, correct.values)
+
+    def test_fillforward_frames(self):
+        """
+        batched fillforward should match asfreq per frame
+        """
+        weekly = pd.DataFrame({'close': df.close[:5000].downsample('W-FRI').last()})
+        other = weekly.copy() * 2
+        other.index = weekly.index.copy()
+        short = weekly[5:]
+        frames = {'a': weekly, 'b': other, 'c': short}
+
+        test = ts.fillforward_frames(frames)
+        for key, frame in frames.items():
+            tm.assert_frame_equal(test[key], frame.fillforward())
+        # equal indexes share the target
+        assert test['a'].index is test['b'].index
+
+        # explicit target, dates before the source start are nan
+        target = pd.date_range(weekly.index[2], periods=50, freq='B')
+        test = ts.fillforward_frames(frames, target)
+        for key, frame in frames.items():
+            tm.assert_frame_equal(test[key], frame.reindex(target, method='pad'))
+            tm.assert_frame_equal(test[key], frame.fillforward(target))
+
+    def test_streaming_downsampler(self):
+        """
+        streaming in batches should match downsampling the whole history
+        """
+        ticks = pd.DataFrame({'price': df.close, 'vol': df.vol})[:5000]
+        correct = ticks.downsample('30min').ohlc(price='price', vwap=True, count=True)
+
+        stream = ts.StreamingDownsampler('30min', vwap=True, count=True)
+        parts = []
+        for i in range(0, len(ticks), 137):
+            parts.append(stream.update(ticks[i:i+137]))
+            # provisional bar should be the last bar so far
+            current = stream.current
+            assert len(current) == 1
+        parts.append(stream.flush())
+        test = pd.concat(parts)
+        tm.assert_frame_equal(test, correct)
+
+    def test_streaming_downsampler_anchor(self):
+        """
+        7min doesn't divide a day, so the edges hang off the first tick.
+        Later batches need to stay on that grid.
+        """
+        ticks = pd.DataFrame({'price': df.close, 'vol': df.vol})[3:5000]
+        correct = ticks.downsample('7min').ohlc(price='price')
+
+        stream = ts.StreamingDownsampler('7min')
+        parts = []
+        for i in range(0, len(ticks), 137):
+            parts.append(stream.update(ticks[i:i+137]))
+        parts.append(stream.flush())
+        test = pd.concat(parts)
+        tm.assert_frame_equal(test, correct)
+
 if __name__ == '__main__':
     import nose
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)
@@ -254,6 +254,79 @@ class TestTopper(TestCase):
             test = testdf.iloc[x]
             tm.assert_almost_equal(test, correct)
 
+    def test_topn_2d(self):
+        """
+        The vectorized engine should match running topn/topargn per row,
+        including rows with nans and rows with fewer than N values.
+        """
+        vals = np.random.randn(100, 10)
+        vals[vals > 1] = np.nan
+        vals[5] = np.nan
+        columns = pd.Index(list('abcdefghij'))
+
+        for N in [3, -3, 10, -10, 20]:
+            for ascending in [None, True, False]:
+                res = topper.topn_2d(vals, N, ascending=ascending, columns=columns)
+                for x in range(len(vals)):
+                    correct = topper.topn(vals[x], N, ascending=ascending)
+                    count = len(correct)
+                    tm.assert_almost_equal(res.values[x][:count], correct)
+                    assert np.all(np.isnan(res.values[x][count:]))
+
+                    pos = res.positions[x]
+                    assert np.all(pos[count:] == -1)
+                    tm.assert_almost_equal(vals[x][pos[:count]], correct)
+                    assert np.all(res.labels[x][:count] == columns[pos[:count]])
+
+    def test_topn_n_jobs(self):
+        """
+        Threaded row blocks should match the single threaded output
+        """
+        df = pd.DataFrame(np.random.randn(1003, 8))
+        df[df > 1.2] = np.nan
+        for N in [3, -3, 10]:
+            tm.assert_frame_equal(topper.topn_df(df, N, n_jobs=4),
+                                  topper.topn_df(df, N))
+            tm.assert_frame_equal(topper.topargn_df(df, N, n_jobs=4),
+                                  topper.topargn_df(df, N))
+            tm.assert_frame_equal(topper.topindexn_df(df, N, n_jobs=-1),
+                                  topper.topindexn_df(df, N))
+
+    def test_topn_tracker(self):
+        """
+        Appending in chunks should give the same results as running
+        topn on the whole frame.
+        """
+        df = pd.DataFrame(np.random.randn(50, 8), columns=list('abcdefgh'))
+        df[df > 1.2] = np.nan
+
+        for N in [3, -3, 10]:
+            # rows
+            tracker = topper.TopNTracker(N)
+            for i in range(0, len(df), 7):
+                tracker.append(df.iloc[i:i+7])
+            tm.assert_frame_equal(tracker.topn(), topper.topn_df(df, N))
+            tm.assert_frame_equal(tracker.topargn(), topper.topargn_df(df, N))
+
+            # columns
+            tracker = topper.TopNTracker(N, ascending=True)
+            tracker.append(df[['a', 'b', 'c']])
+            tracker.append_columns(df[['d', 'e', 'f', 'g', 'h']])
+            tm.assert_frame_equal(tracker.topn(), topper.topn_df(df, N, ascending=True))
+
+            # running topn per column
+            tracker = topper.TopNTracker(N, axis=0)
+            for i in range(0, len(df), 7):
+                tracker.append(df.iloc[i:i+7])
+            test = tracker.topn()
+            test_args = tracker.topargn()
+            for col in df.columns:
+                correct = topper.topn(df[col].values, N)
+                count = len(correct)
+                tm.assert_almost_equal(test[col].values[:count], correct)
+                pos = test_args[col].values[:count]
+                tm.assert_almost_equal(df[col].values[pos], correct)
+
 if __name__ == '__main__':
     import nose
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)
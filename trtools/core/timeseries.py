@@ -1,16 +1,18 @@
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
+from collections import OrderedDict
 from functools import partial
 from dateutil import relativedelta
 import calendar
+import weakref
 
 from pandas import DateOffset, datetools, DataFrame, Series, Panel
 from pandas.tseries.index import DatetimeIndex
 from pandas.tseries.resample import _get_range_edges
 from pandas.core.groupby import DataFrameGroupBy, PanelGroupBy, BinGrouper
-from pandas.tseries.resample import TimeGrouper
 from pandas.tseries.offsets import Tick
-from pandas.tseries.frequencies import _offset_map, to_offset
+from pandas.tseries.frequencies import _offset_map, to_offset, is_superperiod
 import pandas.lib as lib
+from pandas.tslib import iNaT
 import numpy as np
 
 from trtools.monkey import patch, patch_prop
@@ -65,6 +67,10 @@ def monthly_group(df):
     return down_sample(df, daterange_func)
 
 def down_sample(obj, daterange_func):
+    """
+        Group each row with the last date of the range at or before it.
+        Rows before the first date are dropped, as are empty groups.
+    """
     if isinstance(obj, Panel):
         index = obj.major_axis
     else:
@@ -73,7 +79,13 @@ def down_sample(obj, daterange_func):
     start = datetime.combine(index[0].date(), time(0))
     end = datetime.combine(index[-1].date(), time(0))
     range = daterange_func(start=start, end=end)
-    grouped = obj.groupby(range.asof)
+    obj = obj.truncate(before=range[0])
+    index = obj._get_axis(1 if isinstance(obj, Panel) else 0)
+
+    bins = index.asi8.searchsorted(range.asi8[1:], side='left')
+    bins = np.r_[bins, len(index)].astype(np.int64)
+    bins, labels = _drop_empty_bins(bins, range)
+    grouped = obj.groupby(BinGrouper(bins, labels))
     grouped._range = range
     return grouped
 
@@ -103,6 +115,16 @@ def aggregate_picker(grouped, grouped_indices, col=None):
 
     Should take something in that form and return a DataFrame with the proper date indexes and values...
     """
+    obj = _picker_obj(grouped, col)
+    if obj is not None:
+        # bin positions are relative to the start of each bin
+        grouper = grouped.grouper
+        starts, ends = _bin_starts(grouper)
+        sub = grouped_indices.reindex(grouper.binlabels)
+        keep = sub.notnull().values
+        positions = starts[keep] + sub.values[keep].astype(int)
+        return {'index':obj.index.take(positions), 'values':obj.values.take(positions)}
+
     index = []
     values = []
     for key, group in grouped:
@@ -117,20 +139,99 @@ def aggregate_picker(grouped, grouped_indices, col=None):
 def _kv_agg(grouped, func, col=None):
     """
         Works like agg but returns index label and value for each hit
+
+        np.argmax/np.argmin on a BinGrouper skip the agg, see kv_agg.
     """
+    picks = _bin_picks(grouped, func, col)
+    if picks is not None:
+        return picks
+
     if col:
         sub_indices = grouped.agg({col: func})[col]
     else:
         sub_indices = grouped.agg(func)
 
     data = aggregate_picker(grouped, sub_indices, col=col)
-    return TimeSeries(data['values'], index=data['index'])
+    return Series(data['values'], index=data['index'])
+
+_arg_funcs = {
+    np.argmax: 'max',
+    np.argmin: 'min',
+    'argmax': 'max',
+    'argmin': 'min',
+}
+
+def _picker_obj(grouped, col=None):
+    """
+        The Series to pick from if we can use the bin edges, else None
+    """
+    if not isinstance(grouped.grouper, BinGrouper):
+        return None
+    obj = grouped.obj
+    if col:
+        obj = obj[col]
+    if not isinstance(obj, Series):
+        return None
+    return obj
+
+def bin_argextrema(values, bins, how='max'):
+    """
+        Position of the max/min of each bin in one pass over the bin edges.
+        Positions are into values, not relative to the bin. nans are skipped
+        and bins without any values are -1. Ties go to the first occurrence
+        like np.argmax.
+    """
+    starts, ends = _bin_starts(bins)
+    out = np.empty(len(ends), dtype=int)
+    out[:] = -1
+    nonempty = ends > starts
+    if not nonempty.any():
+        return out
+    starts = starts[nonempty]
+    ends = ends[nonempty]
+    end = ends[-1]
+
+    vals = np.asarray(values, dtype=float)[:end]
+    valid = ~np.isnan(vals)
+    if how == 'max':
+        extreme = np.maximum.reduceat(np.where(valid, vals, -np.inf), starts)
+    else:
+        extreme = np.minimum.reduceat(np.where(valid, vals, np.inf), starts)
+
+    hits = valid & (vals == np.repeat(extreme, ends - starts))
+    pos = np.minimum.reduceat(np.where(hits, np.arange(end), end), starts)
+    pos[pos == end] = -1
+    out[nonempty] = pos
+    return out
+
+def _bin_picks(grouped, func, col=None):
+    """
+        argmax/argmin hits for every bin at once, None if func or the
+        grouper need the per group path. Bins with all nans are left out.
+    """
+    try:
+        how = _arg_funcs.get(func)
+    except TypeError: # unhashable func
+        how = None
+    obj = _picker_obj(grouped, col)
+    if how is None or obj is None:
+        return None
+    positions = bin_argextrema(obj.values, grouped.grouper, how)
+    positions = positions[positions >= 0]
+    return Series(obj.values.take(positions), index=obj.index.take(positions))
 
 def kv_agg(grouped, func, col=None):
     """
         Simpler version that is a bit faster. Really, I don't use aggregate_picker,
         which makes it slightly faster.
+
+        np.argmax/np.argmin on a BinGrouper don't iterate the groups. The
+        positions for every bin are found at once and the labels and values
+        are pulled with a single take. Bins with all nans are left out.
     """
+    picks = _bin_picks(grouped, func, col)
+    if picks is not None:
+        return picks
 
     index = []
     values = []
@@ -143,18 +244,53 @@ def kv_agg(grouped, func, col=None):
         values.append(val)
         index.append(group.index[sub_index])
 
-    return TimeSeries(values, index=index)
+    return Series(values, index=index)
+
+NS_PER_SECOND = 10**9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+def time_of_day(arr):
+    """
+        Nanoseconds since midnight for each datetime as int64.
+        Anything convertible to DatetimeIndex works.
+    """
+    index = DatetimeIndex(arr)
+    if index.tz is None:
+        return index.asi8 % NS_PER_DAY
+    # asi8 is UTC, measure from local midnight
+    return index.asi8 - index.normalize().asi8
+
+def _times_from_ns(tod, seconds_only=False):
+    """
+        datetime.time objects from nanoseconds since midnight. Intraday
+        indexes only have a handful of distinct times, so only those get
+        turned into objects.
+    """
+    if seconds_only:
+        tod = tod - tod % NS_PER_SECOND
+    uniq, inverse = np.unique(tod, return_inverse=True)
+    objs = np.empty(len(uniq), dtype=object)
+    for i, ns in enumerate(uniq):
+        seconds, ns = divmod(int(ns), NS_PER_SECOND)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        objs[i] = time(hour, minute, second, ns // 1000)
+    return objs.take(inverse)
 
 def set_time(arr, hour, minute):
     """
         Given a list of datetimes, set the time on all of them
+
+        Returns a DatetimeIndex
     """
-    results = []
-    t = time(hour, minute)
-    for date in arr:
-        d = datetime.combine(date.date(), t)
-        results.append(d)
-    return results
+    index = DatetimeIndex(arr)
+    offset = hour * NS_PER_HOUR + minute * NS_PER_MINUTE
+    if index.tz is not None:
+        return index.normalize() + timedelta(hours=hour, minutes=minute)
+    vals = index.asi8
+    return DatetimeIndex(vals - vals % NS_PER_DAY + offset)
 
 def reset_time(df, hour, minute):
     if isinstance(df, (DataFrame, Series)):
@@ -167,32 +303,38 @@ def max_groupby(grouped, col=None):
     df = kv_agg(grouped, np.argmax, col)
     return df
 
-def trading_hours(df):
+def trading_hours(df, calendar=None):
     # assuming timestamp marks end of bar
+    if calendar is not None:
+        inds = calendar.in_session(df.index).nonzero()[0]
+        return df.take(inds)
     inds = df.index.indexer_between_time(time(9,30),
                                          time(16), include_start=False)
     return df.take(inds)
 
-times = np.vectorize(lambda x: x.time())
-hours = np.vectorize(lambda x: x.time().hour)
-minutes = np.vectorize(lambda x: x.time().minute)
+def times(arr):
+    return _times_from_ns(time_of_day(arr))
+
+def hours(arr):
+    return time_of_day(arr) // NS_PER_HOUR
+
+def minutes(arr):
+    return time_of_day(arr) // NS_PER_MINUTE % 60
 
 def time_slice(series, hour=None, minute=None):
     """
-        Will vectorize a function taht returns a boolean array if value matches the hour
-        and/or minute
+        Returns a boolean array if value matches the hour and/or minute
     """
     bh = hour is not None
     bm = minute is not None
+    tod = time_of_day(series.index)
     if bh and bm:
-        t = time(hour, minute)
-        vec = np.vectorize(lambda x: x.time() == t)
+        # exact time, so seconds have to be 0 as well
+        return tod == hour * NS_PER_HOUR + minute * NS_PER_MINUTE
     if bh and not bm:
-        vec = np.vectorize(lambda x: x.time().hour == hour)
+        return tod // NS_PER_HOUR == hour
     if not bh and bm:
-        vec = np.vectorize(lambda x: x.time().minute == minute)
-
-    return vec(series.index)
+        return tod // NS_PER_MINUTE % 60 == minute
 
 def end_asof(index, label):
     """
@@ -208,6 +350,165 @@ def end_asof(index, label):
 
     return label
 
+def _time_ns(t):
+    seconds = (t.hour * 60 + t.minute) * 60 + t.second
+    return seconds * NS_PER_SECOND + t.microsecond * 1000
+
+def read_holidays(path):
+    """
+        Read a holiday file. One date per line, half days list the
+        early close after the date:
+
+            2013-12-25
+            2013-11-29 13:00
+
+        Blank lines and # comments are skipped.
+
+        Returns
+        -------
+        holidays : list of dates
+        half_days : dict of date -> close time
+    """
+    holidays = []
+    half_days = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split('#')[0].split()
+            if not parts:
+                continue
+            day = datetime.strptime(parts[0], '%Y-%m-%d').date()
+            if len(parts) == 1:
+                holidays.append(day)
+            else:
+                half_days[day] = datetime.strptime(parts[1], '%H:%M').time()
+    return holidays, half_days
+
+class SessionCalendar(object):
+    """
+        Trading sessions over a date range.
+
+        The open/close of every session is computed once as int64 nanoseconds,
+        so masks, session ids and bins are all searchsorted calls. Timestamps
+        mark the end of a bar, so a session covers (open, close].
+        Only tz-naive indexes are supported.
+
+        Parameters
+        ----------
+        start, end : date range of the calendar
+        open, close : session times
+        holidays : dates without a session
+        half_days : dict of date -> early close time
+        weekmask : weekdays with sessions, Monday=0
+    """
+    def __init__(self, start, end, open=time(9, 30), close=time(16),
+                 holidays=None, half_days=None, weekmask=(0, 1, 2, 3, 4)):
+        days = DatetimeIndex(start=start, end=end, freq='D', normalize=True)
+        mask = np.in1d(days.weekday, weekmask)
+        if holidays:
+            mask &= ~np.in1d(days.asi8, DatetimeIndex(list(holidays)).asi8)
+        self.sessions = days[mask]
+
+        day_ns = self.sessions.asi8
+        self.opens = day_ns + _time_ns(open)
+        self.closes = day_ns + _time_ns(close)
+        for day, early in (half_days or {}).items():
+            day = DatetimeIndex([day]).asi8[0]
+            loc = day_ns.searchsorted(day)
+            if loc < len(day_ns) and day_ns[loc] == day:
+                self.closes[loc] = day + _time_ns(early)
+
+        self._edges = {}
+
+    @classmethod
+    def from_file(cls, path, start, end, **kwargs):
+        """
+            Calendar with holidays and half days from a file. See read_holidays
+        """
+        holidays, half_days = read_holidays(path)
+        return cls(start, end, holidays=holidays, half_days=half_days, **kwargs)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _positions(self, index):
+        vals = DatetimeIndex(index).asi8
+        # last session that opened strictly before each timestamp
+        return self.opens.searchsorted(vals, side='left') - 1, vals
+
+    def session_ids(self, index):
+        """
+            Session position for each timestamp, -1 outside of a session
+        """
+        pos, vals = self._positions(index)
+        if not len(self):
+            return np.repeat(-1, len(vals))
+        inside = (pos >= 0) & (vals <= self.closes.take(pos.clip(0, None)))
+        return np.where(inside, pos, -1)
+
+    def in_session(self, index):
+        return self.session_ids(index) >= 0
+
+    def asof(self, index):
+        """
+            Open of the session each timestamp falls in. NaT outside of a session.
+        """
+        ids = self.session_ids(index)
+        if not len(self):
+            return DatetimeIndex(np.repeat(iNaT, len(ids)))
+        opens = np.where(ids >= 0, self.opens.take(ids.clip(0, None)), iNaT)
+        return DatetimeIndex(opens)
+
+    def session_bins(self, index):
+        """
+            Bins grouping a sorted index by session, labeled by session date.
+            Timestamps outside a session go into the prior session so the bins
+            stay contiguous. Filter with trading_hours first to drop them.
+        """
+        pos = self._positions(index)[0].clip(0, None)
+        bins = pos.searchsorted(np.arange(len(self)), side='right')
+        return _drop_empty_bins(bins, self.sessions)
+
+    def anchor_edges(self, freq):
+        """
+            Bar edges every freq from each session open, ending on the
+            session close. Computed once per freq.
+        """
+        offset = to_offset(freq)
+        edges = self._edges.get(offset)
+        if edges is not None:
+            return edges
+        if not _is_tick(offset):
+            raise ValueError("anchor freq must be a fixed frequency: {0}".format(freq))
+        step = offset.nanos
+        # edges per session, ceil of the bars per session plus the open
+        counts = -((self.opens - self.closes) // step) + 1
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        k = np.arange(counts.sum()) - np.repeat(starts, counts)
+        edges = np.minimum(np.repeat(self.opens, counts) + k * step,
+                           np.repeat(self.closes, counts))
+        self._edges[offset] = edges
+        return edges
+
+    def anchor_bins(self, index, freq):
+        """
+            Bins on the anchor edges, labeled by bar end. Timestamps between
+            sessions fall in the bar ending at the next open.
+        """
+        edges = self.anchor_edges(freq)
+        bins = DatetimeIndex(index).asi8.searchsorted(edges[1:], side='right')
+        return _drop_empty_bins(bins, DatetimeIndex(edges[1:]))
+
+    def bins(self, index, freq):
+        """
+            Intraday freqs anchor to session opens, daily groups by session.
+        """
+        offset = to_offset(freq)
+        if _is_tick(offset) and offset.nanos < NS_PER_DAY:
+            return self.anchor_bins(index, offset)
+        if offset.n == 1 and offset.rule_code in ('D', 'B'):
+            return self.session_bins(index)
+        raise ValueError("SessionCalendar only bins intraday and daily: {0}".format(freq))
+
 # TODO Forget where I was using this. I think pandas does this now.
 class TimeIndex(object):
     """
@@ -215,26 +516,26 @@ class TimeIndex(object):
     """
     def __init__(self, times):
         self.times = times
+        self._ns = np.sort(np.array([_time_ns(t) for t in times], dtype=np.int64))
 
     def asof(self, date):
         """
             Follows price is right rules. Will return the closest time that is equal or below.
-            If time is after the last date, it will just return the date.
+            If time is before the first time, it will just return the date.
+
+            Takes a single datetime or a whole DatetimeIndex.
         """
-        testtime = date.time()
-        last = None
-        for time in self.times:
-            if testtime == time:
-                return date
-            if testtime < time:
-                # found spot
-                break
-            last = time
+        if isinstance(date, datetime):
+            return self.asof(DatetimeIndex([date]))[0]
+
+        index = DatetimeIndex(date)
+        tod = time_of_day(index)
+        pos = self._ns.searchsorted(tod, side='right') - 1
         # TODO should I anchor this to the last time?
-        if last is None:
-            return date
-        new_date = datetime.combine(date.date(), last)
-        return new_date
+        found = pos >= 0
+        vals = index.asi8.copy()
+        vals[found] += self._ns.take(pos[found]) - tod[found]
+        return DatetimeIndex(vals, tz=index.tz, name=index.name)
 
 def get_time_index(freq, start=None, end=None):
     if start is None:
@@ -242,8 +543,7 @@ def get_time_index(freq, start=None, end=None):
     if end is None:
         end = "1/1/2012 4:00PM"
     ideal = DatetimeIndex(start=start, end=end, freq=freq)
-    times = [date.time() for date in ideal]
-    return TimeIndex(times)
+    return TimeIndex(times(ideal))
 
 def get_anchor_index(index, freq):
     ideal = get_time_index(freq)
@@ -255,20 +555,30 @@ def get_anchor_index(index, freq):
     ind = DatetimeIndex(start=start, end=end, freq=freq)
     return ind
 
-def anchor_downsample(obj, freq, axis=None):
+def anchor_downsample(obj, freq, axis=None, calendar=None):
     """
         Point of this is to fix the freq to regular intervals like 9:30, 9:45, 10:00
         and not 9:13, 9:28: 9:43
+
+        With a SessionCalendar the bars anchor on each session open and
+        stop at the session close.
     """
     if axis is None:
         axis = 0
         if isinstance(obj, Panel):
             axis = 1
     index = obj._get_axis(axis)
-    ind = get_anchor_index(index, freq)
-    bins = lib.generate_bins_dt64(index.asi8, ind.asi8, closed='right')
-    labels = ind[1:]
-    grouper = BinGrouper(bins, labels)
+    key = ('anchor', to_offset(freq), calendar)
+    grouper = bin_cache.get(index, key)
+    if grouper is None and calendar is not None:
+        grouper = BinGrouper(*calendar.anchor_bins(index, freq))
+        bin_cache.set(index, key, grouper)
+    if grouper is None:
+        ind = get_anchor_index(index, freq)
+        bins = lib.generate_bins_dt64(index.asi8, ind.asi8, closed='right')
+        labels = ind[1:]
+        grouper = BinGrouper(bins, labels)
+        bin_cache.set(index, key, grouper)
     return obj.groupby(grouper)
 # END TODO
 
@@ -290,11 +600,147 @@ def ohlc_grouped_cython(grouped):
     hldf = hldf.reindex(columns=['open', 'high', 'low', 'close', 'vol'])
     return hldf
 
+def _bin_starts(bins):
+    bins = getattr(bins, 'bins', bins) # accept a BinGrouper
+    ends = np.asarray(bins, dtype=int)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1]
+    return starts, ends
+
+def _bin_first_last(valid, starts, end):
+    """ positions of first and last valid value for each bin. -1 if none """
+    pos = np.arange(end)
+    first = np.minimum.reduceat(np.where(valid, pos, end), starts)
+    last = np.maximum.reduceat(np.where(valid, pos, -1), starts)
+    first[first == end] = -1
+    return first, last
+
+def _bin_extreme(vals, valid, starts, ufunc, fill):
+    res = ufunc.reduceat(np.where(valid, vals, fill), starts)
+    res[np.add.reduceat(valid, starts) == 0] = np.nan
+    return res
+
+def bars_to_ohlc(opens, highs, lows, closes, volumes, bins, vwap=False, count=False):
+    """
+        Aggregate bars into bigger bars in a single vectorized pass over the
+        bin edges. Empty bins and bins with no prices are nan.
+
+        Returns
+        -------
+        OrderedDict of open, high, low, close, vol (if volumes), vwap, count
+    """
+    starts, ends = _bin_starts(bins)
+    nbins = len(ends)
+    nonempty = ends > starts
+    starts = starts[nonempty]
+    end = ends[-1] if nbins else 0
+
+    cols = ['open', 'high', 'low', 'close']
+    if volumes is not None:
+        cols.append('vol')
+    if vwap:
+        cols.append('vwap')
+    if count:
+        cols.append('count')
+
+    out = OrderedDict()
+    for col in cols:
+        out[col] = np.empty(nbins)
+        out[col][:] = np.nan
+    if len(starts) == 0:
+        return out
+
+    opens, highs, lows, closes = [np.asarray(arr, dtype=float)[:end]
+                                  for arr in (opens, highs, lows, closes)]
+
+    valid = ~np.isnan(opens)
+    first, _ = _bin_first_last(valid, starts, end)
+    out['open'][nonempty] = np.where(first >= 0, opens.take(first), np.nan)
+
+    valid = ~np.isnan(closes)
+    _, last = _bin_first_last(valid, starts, end)
+    out['close'][nonempty] = np.where(last >= 0, closes.take(last), np.nan)
+
+    valid = ~np.isnan(highs)
+    out['high'][nonempty] = _bin_extreme(highs, valid, starts, np.maximum, -np.inf)
+    valid = ~np.isnan(lows)
+    out['low'][nonempty] = _bin_extreme(lows, valid, starts, np.minimum, np.inf)
+
+    if count:
+        out['count'][nonempty] = np.add.reduceat(~np.isnan(closes), starts)
+
+    if volumes is None:
+        return out
+
+    volumes = np.asarray(volumes, dtype=float)[:end]
+    vol_valid = ~np.isnan(volumes)
+    out['vol'][nonempty] = np.add.reduceat(np.where(vol_valid, volumes, 0), starts)
+
+    if vwap:
+        traded = vol_valid & ~np.isnan(closes)
+        notional = np.add.reduceat(np.where(traded, closes * volumes, 0), starts)
+        traded_vol = np.add.reduceat(np.where(traded, volumes, 0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out['vwap'][nonempty] = notional / traded_vol
+
+    return out
+
+def ticks_to_ohlc(prices, volumes=None, bins=None, vwap=False, count=False, labels=None):
+    """
+        Build ohlc bars from ticks in one pass over the bins.
+
+        Parameters
+        ----------
+        prices : array-like
+        volumes : array-like, optional
+        bins : BinGrouper or array of bin end positions, i.e. from downsample
+        vwap : bool
+            Add volume weighted average price column
+        count : bool
+            Add number of trades column
+        labels : Index, optional
+            Defaults to the BinGrouper.binlabels
+    """
+    if labels is None:
+        labels = getattr(bins, 'binlabels', None)
+    data = bars_to_ohlc(prices, prices, prices, prices, volumes, bins,
+                        vwap=vwap, count=count)
+    return DataFrame(data, index=labels, columns=list(data.keys()))
+
 # monkey patches
 
 @patch(DataFrameGroupBy, 'ohlc')
-def ohlc(self):
-    return ohlc_grouped_cython(self)
+def ohlc(self, price=None, vol='vol', vwap=False, count=False):
+    """
+        Parameters
+        ----------
+        price : string, optional
+            Column of tick prices. By default the frame is assumed to already
+            be bars with open/high/low/close columns
+        vol : string
+            Volume column. Skipped if it doesn't exist
+        vwap : bool
+        count : bool
+    """
+    grouper = self.grouper
+    if not isinstance(grouper, BinGrouper):
+        if price is not None or vwap or count:
+            raise Exception("ticks/vwap/count ohlc needs a BinGrouper")
+        return ohlc_grouped_cython(self)
+
+    obj = self.obj
+    volumes = None
+    if vol is not None and vol in obj.columns:
+        volumes = obj[vol].values
+
+    if price is not None:
+        return ticks_to_ohlc(obj[price].values, volumes, grouper, vwap=vwap,
+                             count=count)
+
+    data = bars_to_ohlc(obj['open'].values, obj['high'].values, obj['low'].values,
+                        obj['close'].values, volumes, grouper, vwap=vwap, count=count)
+    return DataFrame(data, index=grouper.binlabels, columns=list(data.keys()))
 
 LEFT_OFFSETS = [
     'D',
@@ -321,11 +767,12 @@ class Downsample(object):
         self.obj = obj
         self.axis = axis
 
-    def __call__(self, freq, closed=None, label=None, axis=None, drop_empty=True):
+    def __call__(self, freq, closed=None, label=None, axis=None, drop_empty=True,
+                 calendar=None):
         if axis is None:
             axis = self.axis
         return downsample(self.obj, freq=freq, closed=closed, label=label, axis=axis,
-                         drop_empty=drop_empty)
+                         drop_empty=drop_empty, calendar=calendar)
 
     def __getattr__(self, key):
         key = key.replace('_', '-')
@@ -348,10 +795,84 @@ def downsample_prop(self):
 def downsample_prop_panel(self):
     return Downsample(self, axis=1)
 
-def downsample(self, freq, closed=None, label=None, axis=0, drop_empty=True):
+class BinCache(object):
+    """
+        LRU cache of BinGroupers for downsample.
+
+        Entries are keyed on the identity of the index and the downsample
+        params. Each entry only keeps a weakref to its index and is dropped
+        once the index is collected, so the cache never keeps a large index
+        alive and an id can't be reused while its entry is cached. Indexes
+        are immutable, so a hit can hand back the grouper without looking at
+        the data.
+
+        maxsize bounds the number of entries. clear() empties the cache.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, index, key):
+        full_key = (id(index), key)
+        entry = self._cache.get(full_key)
+        if entry is None or entry[0]() is not index:
+            self.misses += 1
+            return None
+        # move to most recently used
+        del self._cache[full_key]
+        self._cache[full_key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, index, key, grouper):
+        full_key = (id(index), key)
+        self._cache.pop(full_key, None)
+        ref = weakref.ref(index, partial(self._discard, full_key))
+        self._cache[full_key] = (ref, grouper)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def _discard(self, full_key, ref):
+        # weakref callback, the index is gone
+        entry = self._cache.get(full_key)
+        if entry is not None and entry[0] is ref:
+            del self._cache[full_key]
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+bin_cache = BinCache()
+
+def downsample(self, freq, closed=None, label=None, axis=0, drop_empty=True,
+               calendar=None):
     """
         Essentially use resample logic but reutrning the groupby object
+
+        The BinGrouper is cached in bin_cache, so downsampling frames that
+        share an index only computes the bins once.
+
+        Passing a SessionCalendar bins on its sessions instead. See
+        SessionCalendar.bins. Those bins are fixed, so closed, label and
+        drop_empty=False can't be combined with a calendar.
     """
+    if calendar is not None:
+        if closed is not None or label is not None or not drop_empty:
+            raise ValueError("closed, label and drop_empty don't apply to "
+                             "calendar bins")
+        index = self._get_axis(axis)
+        key = ('session', to_offset(freq), calendar)
+        grouper = bin_cache.get(index, key)
+        if grouper is None:
+            grouper = BinGrouper(*calendar.bins(index, freq))
+            bin_cache.set(index, key, grouper)
+        return self.groupby(grouper, axis=axis)
 
     # default closed/label on offset
     defaults = _offset_defaults(freq)
@@ -360,39 +881,310 @@ def downsample(self, freq, closed=None, label=None, axis=0, drop_empty=True):
 
     if label is None:
         label = defaults['label']
-    tg = TimeGrouper(freq, closed=closed, label=label, axis=axis)
-    groupby = self.groupby(tg)
-    grouper = groupby.grouper
 
+    index = self._get_axis(axis)
+    key = (to_offset(freq), closed, label, drop_empty)
+    grouper = bin_cache.get(index, key)
+    if grouper is None:
+        grouper = _downsample_grouper(self, freq, closed, label, axis, drop_empty)
+        bin_cache.set(index, key, grouper)
+
+    return self.groupby(grouper, axis=axis)
+
+def _downsample_grouper(self, freq, closed, label, axis, drop_empty):
+    index = self._get_axis(axis)
+    bins, binlabels = time_bins(index, to_offset(freq), closed, label)
 
     # drop empty groups. this is when we have irregular data that
     # we just want to group into Daily without creating empty days.
     if drop_empty:
-        bins = [0] # start with 0 for np.diff
-        bins.extend(grouper.bins)
-        bins = np.array(bins)
-        periods_in_bin = np.diff(bins)
-        empty = periods_in_bin == 0
+        bins, binlabels = _drop_empty_bins(bins, binlabels)
 
-        binlabels = grouper.binlabels
+    return BinGrouper(bins, binlabels)
 
-        # skip the 0 we added
-        bins = bins[1:][~empty]
-        binlabels = binlabels[~empty]
-        grouper = BinGrouper(bins, binlabels)
+def _drop_empty_bins(bins, binlabels):
+    periods_in_bin = np.diff(np.r_[0, bins])
+    empty = periods_in_bin == 0
+    return bins[~empty], binlabels[~empty]
 
-    return self.groupby(grouper, axis=axis)
+def time_bins(index, offset, closed, label, origin=None):
+    """
+        Compute the bins straight from index.asi8 instead of running a
+        groupby with TimeGrouper. Follows TimeGrouper._get_time_bins,
+        including its edge adjustments for freqs longer than a day.
+
+        Parameters
+        ----------
+        origin : Timestamp, optional
+            Ticks that don't divide a day are anchored on the first
+            timestamp. For index being a later chunk of a series, pass the
+            series' first timestamp to get the same edges.
+
+        Returns
+        -------
+        bins : ndarray of bin end positions
+        labels : DatetimeIndex
+    """
+    if len(index) == 0:
+        return np.array([], dtype=np.int64), index[:0]
+
+    first, last = _get_range_edges(index, offset, closed=closed)
+    if origin is not None and isinstance(offset, Tick) and NS_PER_DAY % offset.nanos:
+        # snap onto the edges of a series that started at origin. can add
+        # an empty leading bin
+        grid, _ = _get_range_edges(DatetimeIndex([origin]), offset, closed=closed)
+        first = grid + offset * int((first.value - grid.value) // offset.nanos)
+    binner = labels = DatetimeIndex(freq=offset, start=first.replace(tzinfo=None),
+                                    end=last.replace(tzinfo=None), tz=index.tz,
+                                    name=index.name)
+
+    trimmed = False
+    if len(binner) > 2 and binner[-2] == index[-1] and closed == 'right':
+        binner = binner[:-1]
+        trimmed = True
+
+    ax_values = index.asi8
+    bin_edges = binner.asi8
+    if offset != 'D' and is_superperiod(offset, 'D'):
+        if closed == 'right':
+            bin_edges = bin_edges + NS_PER_DAY - 1
+        # intraday values on last day
+        if bin_edges[-2] > ax_values.max():
+            bin_edges = bin_edges[:-1]
+            binner = binner[:-1]
+
+    side = 'right' if closed == 'right' else 'left'
+    bins = ax_values.searchsorted(bin_edges[1:], side=side)
+
+    labels = binner
+    if label == 'right':
+        labels = labels[1:]
+    elif not trimmed:
+        labels = labels[:-1]
+
+    if len(bins) < len(labels):
+        labels = labels[:len(bins)]
+    return bins, labels
+
+class StreamingDownsampler(object):
+    """
+        Incremental ohlc bars for live ticks.
+
+        Uses the same freq/closed/label rules as downsample. Each update only
+        looks at the new ticks. Every bar before the last one in the batch is
+        final, the last bar stays provisional since more ticks can land in it.
+
+        >>> stream = StreamingDownsampler('5min')
+        >>> bars = stream.update(ticks) # finalized bars
+        >>> stream.current # provisional bar
+        >>> bars = stream.flush() # finalize the provisional bar
+    """
+    _state_cols = ['open', 'high', 'low', 'close', 'vol', 'notional', 'traded_vol', 'count']
+
+    def __init__(self, freq, closed=None, label=None, price='price', vol='vol',
+                 vwap=False, count=False):
+        defaults = _offset_defaults(freq)
+        if closed is None:
+            closed = defaults['closed']
+        if label is None:
+            label = defaults['label']
+        self.offset = to_offset(freq)
+        self.closed = closed
+        self.label = label
+        self.price = price
+        self.vol = vol
+        self.vwap = vwap
+        self.count = count
+        self._current = None # (label, dict of state)
+        # first tick seen, bins are anchored on it like downsample
+        self._origin = None
+
+    @property
+    def columns(self):
+        cols = ['open', 'high', 'low', 'close', 'vol']
+        if self.vwap:
+            cols.append('vwap')
+        if self.count:
+            cols.append('count')
+        return cols
+
+    def _bins(self, index):
+        if self._origin is None:
+            self._origin = index[0]
+        bins, labels = time_bins(index, self.offset, self.closed, self.label,
+                                 origin=self._origin)
+        # drop empty bins like downsample
+        return _drop_empty_bins(bins, labels)
+
+    def _batch_state(self, ticks, bins):
+        if isinstance(ticks, Series):
+            prices = ticks.values
+            volumes = None
+        else:
+            prices = ticks[self.price].values
+            volumes = None
+            if self.vol in ticks.columns:
+                volumes = ticks[self.vol].values
+
+        state = bars_to_ohlc(prices, prices, prices, prices, volumes, bins, count=True)
+        nbins = len(bins)
+        if volumes is None:
+            state['vol'] = np.zeros(nbins)
+            state['notional'] = np.zeros(nbins)
+            state['traded_vol'] = np.zeros(nbins)
+            return state
+
+        starts, ends = _bin_starts(bins)
+        prices = np.asarray(prices, dtype=float)
+        volumes = np.asarray(volumes, dtype=float)
+        traded = ~np.isnan(prices) & ~np.isnan(volumes)
+        state['notional'] = np.add.reduceat(np.where(traded, prices * volumes, 0), starts)
+        state['traded_vol'] = np.add.reduceat(np.where(traded, volumes, 0), starts)
+        return state
+
+    def _merge(self, old, new):
+        """ merge two partial states of the same bar """
+        merged = dict(old)
+        if np.isnan(old['open']):
+            merged['open'] = new['open']
+        if not np.isnan(new['close']):
+            merged['close'] = new['close']
+        merged['high'] = np.nanmax([old['high'], new['high']])
+        merged['low'] = np.nanmin([old['low'], new['low']])
+        for col in ['vol', 'notional', 'traded_vol', 'count']:
+            merged[col] = old[col] + new[col]
+        return merged
+
+    def _to_frame(self, labels, states):
+        data = OrderedDict()
+        for col in ['open', 'high', 'low', 'close', 'vol']:
+            data[col] = [state[col] for state in states]
+        if self.vwap:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data['vwap'] = [state['notional'] / state['traded_vol'] for state in states]
+        if self.count:
+            data['count'] = [state['count'] for state in states]
+        return DataFrame(data, index=DatetimeIndex(labels), columns=self.columns)
+
+    def update(self, ticks):
+        """
+            Add a batch of ticks. Returns the bars that were finalized by this
+            batch.
+        """
+        labels = []
+        states = []
+        if len(ticks) == 0:
+            return self._to_frame(labels, states)
+
+        bins, bin_labels = self._bins(ticks.index)
+        batch = self._batch_state(ticks, bins)
+        batch = [dict((col, batch[col][i]) for col in self._state_cols)
+                 for i in range(len(bins))]
+        bin_labels = list(bin_labels)
+
+        if self._current is not None:
+            cur_label, cur_state = self._current
+            if bin_labels[0] < cur_label:
+                raise Exception("ticks must be appended in order")
+            if bin_labels[0] == cur_label:
+                batch[0] = self._merge(cur_state, batch[0])
+            else:
+                labels.append(cur_label)
+                states.append(cur_state)
+
+        labels.extend(bin_labels[:-1])
+        states.extend(batch[:-1])
+        self._current = (bin_labels[-1], batch[-1])
+        return self._to_frame(labels, states)
+
+    @property
+    def current(self):
+        """ The provisional bar as a one row DataFrame """
+        if self._current is None:
+            return self._to_frame([], [])
+        label, state = self._current
+        return self._to_frame([label], [state])
+
+    def flush(self):
+        """ Finalize and return the provisional bar """
+        bar = self.current
+        self._current = None
+        return bar
 
 # Quick groupbys. _rs stands for resample, though they really use TimeGrouper.
 # Eventuall take out the old groupbys once everything is verified to be equal
 @patch([DataFrame, Series], 'fillforward')
-def fillforward(df):
+def fillforward(df, target=None):
     """
         Take a lower than day freq, and map it to business days.
         This is to make mapping to a daily chart easy and helps handle
         business days that vacations.
+
+        target : DatetimeIndex or SessionCalendar to map onto instead
+    """
+    if target is None:
+        return df.asfreq(datetools.BDay(), method='pad')
+    target, search = _fillforward_target(target)
+    return _pad_take(df, target, _pad_indexer(df.index, search))
+
+def fillforward_frames(frames, target=None):
+    """
+        fillforward for a dict of frames. The target index and pad indexer
+        are built once per unique source index and applied with take, so
+        frames sharing an index don't each redo the asfreq.
+
+        target : DatetimeIndex or SessionCalendar to map every frame onto.
+            Defaults to the business days spanning each source index.
+    """
+    search = None
+    if target is not None:
+        target, search = _fillforward_target(target)
+
+    seen = {}
+    out = OrderedDict()
+    for key, df in frames.items():
+        index = df.index
+        if not len(index):
+            out[key] = df
+            continue
+        # cheap fingerprint, confirmed with a full compare
+        fingerprint = (len(index), index.asi8[0], index.asi8[-1])
+        candidates = seen.setdefault(fingerprint, [])
+        for source, source_target, indexer in candidates:
+            if source is index or np.array_equal(source.asi8, index.asi8):
+                break
+        else:
+            source_target, source_search = target, search
+            if source_target is None:
+                source_target, source_search = _fillforward_target(
+                    DatetimeIndex(start=index[0], end=index[-1], freq=datetools.BDay()))
+            indexer = _pad_indexer(index, source_search)
+            candidates.append((index, source_target, indexer))
+        out[key] = _pad_take(df, source_target, indexer)
+    return out
+
+def _fillforward_target(target):
+    """
+        (labels, search) where search is the int64 time each label is
+        padded up to. Calendar sessions are labeled by date but pad up to
+        the session close, so intraday data lands on its own session.
     """
-    return df.asfreq(datetools.BDay(), method='pad')
+    if isinstance(target, SessionCalendar):
+        return target.sessions, target.closes
+    target = DatetimeIndex(target)
+    return target, target.asi8
+
+def _pad_indexer(index, search):
+    # last source row at or before each search time, -1 if none
+    return index.asi8.searchsorted(search, side='right') - 1
+
+def _pad_take(obj, target, indexer):
+    out = obj.take(indexer.clip(0, None))
+    out.index = target
+    missing = indexer < 0
+    if missing.any():
+        out.ix[missing] = np.nan
+    return out
 
 @patch([Series], 'date')
 def to_date(self):
@@ -417,7 +1209,7 @@ def normalize(self, inplace=False):
 
 @patch_prop([DatetimeIndex], 'time')
 def dt_time(self):
-    return np.array([time(*time_tuple) for time_tuple in zip(self.hour, self.minute, self.second)])
+    return _times_from_ns(time_of_day(self), seconds_only=True)
 
 @patch_prop([DatetimeIndex], 'date')
 def dt_date(self):
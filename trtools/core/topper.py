@@ -1,8 +1,12 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
 import bottleneck as nb
 import pandas as pd
 import numpy as np
 
 from trtools.monkey import patch
+from trtools.tools.parallel import resolve_n_jobs
 
 def bn_topn(arr, N, ascending=None):
     """
@@ -103,43 +107,343 @@ def _topn_series(self, N, ascending=None):
 def _topargn_series(self, N, ascending=None):
     return pd.Series(topargn(self, N, ascending=ascending))
 
-# bn.partsort works on matrix, but i dunno how to handle nans in that case
-# i suppose I could min/max and then set Nan to sentinal values?
+class TopNResult(object):
+    """
+    Shared result of the 2-D topn engine. Rows with fewer non-nan values
+    than N are padded with nan in `values` and -1 in `positions`.
+
+    Parameters
+    ----------
+    values : ndarray (rows x N)
+    positions : ndarray (rows x N)
+        column positions of `values` in the source array
+    columns : Index, optional
+        column labels used to translate `positions` into `labels`
+    """
+    def __init__(self, values, positions, columns=None):
+        self.values = values
+        self.positions = positions
+        self.columns = columns
+
+    @property
+    def valid(self):
+        return self.positions >= 0
+
+    @property
+    def labels(self):
+        if self.columns is None:
+            raise Exception("TopNResult needs columns to return labels")
+        columns = np.asarray(self.columns, dtype=object)
+        labels = columns.take(self.positions)
+        labels[~self.valid] = np.nan
+        return labels
+
+def topn_2d(vals, N, ascending=None, columns=None, n_jobs=None, executor=None):
+    """
+    Vectorized topn over axis=1 of a 2-D array.
+
+    Equivalent to running bn_topn/bn_topargn over each row, but does the
+    partition for all rows in one pass. np.argpartition orders nan after
+    every number, so we partition on the values (or the negated values for
+    nlargest) and nans fall to the end of each row without a sentinel.
+
+    Parameters
+    ----------
+    n_jobs : int, optional
+        Split the rows into blocks and rank them on a thread pool. Rows are
+        independent and the numpy partition/sort kernels release the GIL.
+        -1 uses every core.
+    executor : concurrent.futures.Executor, optional
+        Use an existing pool instead of creating one per call
+
+    Returns
+    -------
+    TopNResult
+    """
+    if vals.ndim != 2:
+        raise Exception("Only works on ndim=2")
+    if ascending is None:
+        ascending = not N > 0
+
+    vals = np.asarray(vals, dtype=float)
+    rows, width = vals.shape
+    # don't make the return have more columns than the source
+    k = min(width, abs(N))
+
+    values = np.empty((rows, k))
+    positions = np.empty((rows, k), dtype=int)
+
+    if executor is None and resolve_n_jobs(n_jobs) == 1:
+        _topn_block(vals, N, ascending, values, positions)
+    else:
+        _topn_parallel(vals, N, ascending, values, positions,
+                       n_jobs=n_jobs, executor=executor)
+    return TopNResult(values, positions, columns=columns)
+
+def _topn_block(vals, N, ascending, values_out, positions_out):
+    """
+    topn for a block of rows. Results are written into the out arrays,
+    which are usually row slices of the full preallocated output.
+    """
+    rows, width = vals.shape
+    k = values_out.shape[1]
+
+    # key is always ascending, so for nlargest we flip the sign
+    key = -vals if N > 0 else vals
+
+    if k < width:
+        positions = np.argpartition(key, k - 1, axis=1)[:, :k]
+    else:
+        positions = np.tile(np.arange(width), (rows, 1))
+
+    sub = np.take_along_axis(key, positions, axis=1)
+    order = np.argsort(sub, axis=1, kind='mergesort')
+    positions = np.take_along_axis(positions, order, axis=1)
+
+    values = np.take_along_axis(vals, positions, axis=1)
+    n_valid = np.minimum((~np.isnan(vals)).sum(axis=1), k)[:, None]
+    slots = np.arange(k)
+    valid = slots < n_valid
+
+    # natural order is greatest magnitude first. reverse only the valid
+    # part of each row so the nan padding stays at the end
+    if ascending == (N > 0):
+        rev = np.where(valid, n_valid - 1 - slots, slots)
+        positions = np.take_along_axis(positions, rev, axis=1)
+        values = np.take_along_axis(values, rev, axis=1)
+
+    values[~valid] = np.nan
+    positions[~valid] = -1
+    values_out[:] = values
+    positions_out[:] = positions
+
+def _row_blocks(rows, n_blocks):
+    """ Contiguous (start, end) row blocks """
+    n_blocks = max(min(n_blocks, rows), 1)
+    edges = np.linspace(0, rows, n_blocks + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+def _topn_parallel(vals, N, ascending, values, positions, n_jobs=None, executor=None):
+    if n_jobs is None:
+        # executor passed in, size blocks for the machine
+        n_jobs = -1
+    n_jobs = resolve_n_jobs(n_jobs)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+    # a few blocks per worker to even out rows with lots of nans
+    blocks = _row_blocks(len(vals), n_jobs * 4)
+    try:
+        futures = [executor.submit(_topn_block, vals[start:end], N, ascending,
+                                   values[start:end], positions[start:end])
+                   for start, end in blocks]
+        for future in futures:
+            future.result()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
 @patch(pd.DataFrame, 'topn', override=True)
-def topn_df(self, N, ascending=None, wrap=True):
-    vals = self.values
-    rows = vals.shape[0]
-    # don't make the return have more columns than the dataframes
-    cols = min(len(self.columns), abs(N))
-    ret = np.ndarray((rows, cols))
-    ret[:] = np.nan
-    for i in range(rows):
-        r = topn(vals[i], N=N, ascending=ascending)
-        ret[i][:len(r)] = r
+def topn_df(self, N, ascending=None, wrap=True, n_jobs=None, executor=None):
+    res = topn_2d(self.values, N, ascending=ascending, n_jobs=n_jobs,
+                  executor=executor)
+    ret = res.values
     if wrap:
         return pd.DataFrame(ret, index=self.index)
     return np.array(ret)
 
 @patch(pd.DataFrame, 'topargn', override=True)
-def topargn_df(self, N, ascending=None, wrap=True):
-    vals = self.values
-    rows = vals.shape[0]
-    ret = np.ndarray((rows, abs(N)), dtype=int)
-    for i in range(rows):
-        r = topargn(vals[i], N=N, ascending=ascending)
-        ret[i] = r
+def topargn_df(self, N, ascending=None, wrap=True, n_jobs=None, executor=None):
+    """
+    Column positions of the topn. Rows with fewer than N non-nan values
+    are padded with -1
+    """
+    res = topn_2d(self.values, N, ascending=ascending, n_jobs=n_jobs,
+                  executor=executor)
+    ret = res.positions
     if wrap:
         return pd.DataFrame(ret, index=self.index)
     return np.array(ret)
 
 @patch(pd.DataFrame, 'topindexn', override=True)
-def topindexn_df(self, N, ascending=None):
+def topindexn_df(self, N, ascending=None, n_jobs=None, executor=None):
     """
     Pretty much topargn, except it returns column key instead of
     positional int
     """
-    # get pos args
-    ret = topargn_df(self, N=N, ascending=ascending, wrap=False)
-    # grab column values
-    ret = self.columns[ret]
-    return pd.DataFrame(ret, index=self.index)
+    res = topn_2d(self.values, N, ascending=ascending, columns=self.columns,
+                  n_jobs=n_jobs, executor=executor)
+    return pd.DataFrame(res.labels, index=self.index)
+
+class TopNTracker(object):
+    """
+    Keeps topn state for a frame that grows over time so appending data
+    doesn't recompute everything that came before.
+
+    axis=1 tracks the topn of each row across columns, same as
+    DataFrame.topn. Appended rows are ranked on their own, appended columns
+    are merged against each row's current topn.
+
+    axis=0 tracks the topn of each column over all rows seen so far. Each
+    column keeps a bounded heap of N entries, so appending a row costs
+    O(log N) per column.
+
+    Output matches bn_topn/bn_topargn, including ascending and nan handling.
+
+    >>> tracker = TopNTracker(5)
+    >>> tracker.append(df.iloc[:100])
+    >>> tracker.append(df.iloc[100:])
+    >>> tracker.topn() # same as df.topn(5)
+    """
+    def __init__(self, N, ascending=None, axis=1):
+        if axis not in (0, 1):
+            raise Exception("axis must be 0 or 1")
+        if ascending is None:
+            ascending = not N > 0
+        self.N = N
+        self.ascending = ascending
+        self.axis = axis
+        self.columns = None
+        self.index = None
+        self._blocks = []
+        self._heaps = []
+
+    def append(self, df):
+        """
+        Append new rows. Columns must match what has already been seen,
+        though for axis=0 new columns will start their own heaps.
+        """
+        if self.columns is None:
+            self.columns = df.columns
+        if self.axis == 1:
+            if not df.columns.equals(self.columns):
+                raise Exception("Appended rows must have the same columns")
+            res = topn_2d(df.values, self.N, ascending=self.ascending)
+            self._blocks.append((res.values, res.positions, df.index))
+        else:
+            self._push_rows(df)
+
+    def append_columns(self, df):
+        """
+        Append new columns for the rows already seen.
+        """
+        if self.columns is None:
+            return self.append(df)
+        if self.axis == 0:
+            if not df.index.equals(self.index):
+                raise Exception("Appended columns must have the same index")
+            return self._push_rows(df, start=0)
+
+        values, positions, index = self._collapse()
+        if not df.index.equals(index):
+            raise Exception("Appended columns must have the same index")
+
+        width = len(self.columns)
+        new_pos = np.arange(width, width + len(df.columns))
+        new_pos = np.tile(new_pos, (len(df), 1))
+        cand_vals = np.hstack([values, np.asarray(df.values, dtype=float)])
+        cand_pos = np.hstack([positions, new_pos])
+
+        # topn of the union is the topn of (old topn + new columns)
+        res = topn_2d(cand_vals, self.N, ascending=self.ascending)
+        positions = np.take_along_axis(cand_pos, res.positions.clip(0), axis=1)
+        positions[~res.valid] = -1
+
+        self.columns = self.columns.append(df.columns)
+        self._blocks = [(res.values, positions, index)]
+
+    def _collapse(self):
+        """
+        Concat the appended blocks into one. Done lazily so a stream of
+        single row appends only pays for the concat when results are asked for.
+        """
+        if len(self._blocks) == 0:
+            raise Exception("TopNTracker is empty")
+        if len(self._blocks) > 1:
+            width = max(b[0].shape[1] for b in self._blocks)
+            values = np.vstack([_pad_width(b[0], width, np.nan) for b in self._blocks])
+            positions = np.vstack([_pad_width(b[1], width, -1) for b in self._blocks])
+            index = self._blocks[0][2]
+            index = index.append([b[2] for b in self._blocks[1:]])
+            self._blocks = [(values, positions, index)]
+        return self._blocks[0]
+
+    def _push_rows(self, df, start=None):
+        # heap root is always the weakest kept entry
+        sign = 1 if self.N > 0 else -1
+        k = abs(self.N)
+        new_rows = start is None
+        if new_rows:
+            start = 0 if self.index is None else len(self.index)
+
+        for col in df.columns:
+            if col not in self.columns:
+                self.columns = self.columns.append(pd.Index([col]))
+        while len(self._heaps) < len(self.columns):
+            self._heaps.append([])
+
+        for col in df.columns:
+            heap = self._heaps[self.columns.get_loc(col)]
+            vals = np.asarray(df[col].values, dtype=float)
+            for i in np.where(~np.isnan(vals))[0]:
+                entry = (sign * vals[i], start + i)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+        if not new_rows:
+            return
+        if self.index is None:
+            self.index = df.index
+        else:
+            self.index = self.index.append(df.index)
+
+    def _heap_results(self):
+        k = abs(self.N)
+        values = np.empty((k, len(self.columns)))
+        values[:] = np.nan
+        positions = np.empty((k, len(self.columns)), dtype=int)
+        positions[:] = -1
+        sign = 1 if self.N > 0 else -1
+        for j, heap in enumerate(self._heaps):
+            # greatest magnitude first
+            entries = sorted(heap, reverse=True)
+            if self.ascending == (self.N > 0):
+                entries = entries[::-1]
+            count = len(entries)
+            values[:count, j] = [sign * e[0] for e in entries]
+            positions[:count, j] = [e[1] for e in entries]
+        return values, positions
+
+    def topn(self):
+        if self.axis == 1:
+            values, positions, index = self._collapse()
+            return pd.DataFrame(values, index=index)
+        values, positions = self._heap_results()
+        return pd.DataFrame(values, columns=self.columns)
+
+    def topargn(self):
+        if self.axis == 1:
+            values, positions, index = self._collapse()
+            return pd.DataFrame(positions, index=index)
+        values, positions = self._heap_results()
+        return pd.DataFrame(positions, columns=self.columns)
+
+    def topindexn(self):
+        if self.axis == 1:
+            values, positions, index = self._collapse()
+            res = TopNResult(values, positions, columns=self.columns)
+            return pd.DataFrame(res.labels, index=index)
+        values, positions = self._heap_results()
+        res = TopNResult(values, positions, columns=self.index)
+        return pd.DataFrame(res.labels, columns=self.columns)
+
+def _pad_width(arr, width, fill):
+    if arr.shape[1] == width:
+        return arr
+    out = np.empty((arr.shape[0], width), dtype=arr.dtype)
+    out[:] = fill
+    out[:, :arr.shape[1]] = arr
+    return out
@@ -14,7 +14,9 @@
 import itertools
 import os.path
 import functools
+import uuid
 
+import numpy as np
 import pandas as pd
 
 from .hdf5_store import HDFFile, OBTFile
@@ -133,3 +135,157 @@ def _panel(items, index, columns, df):
     panel = df.to_panel()
     # to_panel ends up with reverse column order
     return panel.reindex(minor=columns)
+
+def _field_path(path, i):
+    # fields are stored by position, the names live in the columns meta
+    return os.path.join(path, 'field{0}.npy'.format(i))
+
+def _field_pos(filename):
+    if filename.startswith('field') and filename.endswith('.npy'):
+        pos = filename[len('field'):-len('.npy')]
+        if pos.isdigit():
+            return int(pos)
+
+def _is_columnar_file(filename):
+    return filename in ('items', 'index', 'columns', 'format') or \
+            _field_pos(filename) is not None
+
+def is_columnar(path):
+    return os.path.exists(os.path.join(path, 'format'))
+
+def save_columnar(path, items, index, fields):
+    """
+    Columnar bundle. Every field is one (index x items) array saved with
+    np.save, and the axes are pickled alongside like save_panel. Reading
+    a single field is then one contiguous read.
+
+    Parameters
+    ----------
+    path : string
+        Bundle dir
+    items : Index
+    index : Index
+    fields : iterable of (name, ndarray)
+        (index x items) arrays. They are written as they come, so a
+        generator only needs one field in memory at a time.
+
+    NOTE:
+        Only the files the bundle owns (items, index, columns, format and
+        the fieldN.npy files) are replaced, other files in path are left
+        alone. Each is written to a temp name and renamed into place once
+        every field is written, so a save that dies halfway leaves the old
+        bundle as it was. save_panel uses the same meta names, so saving
+        over a dir that has them but is not columnar raises.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if not is_columnar(path) and any(_is_columnar_file(filename)
+                                     for filename in os.listdir(path)):
+        raise ValueError("{0} is not a columnar bundle, will not overwrite".format(path))
+
+    token = uuid.uuid4().hex
+    def temp_path(filepath):
+        dirname, filename = os.path.split(filepath)
+        return os.path.join(dirname, '.{0}.{1}.tmp'.format(filename, token))
+
+    written = []
+    try:
+        nfields = _write_columnar(path, items, index, fields, temp_path, written)
+    except:
+        for filepath in written:
+            tmp = temp_path(filepath)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    # format is the same across saves, rename it last
+    for filepath in written:
+        os.rename(temp_path(filepath), filepath)
+
+    # drop fields left over from a bigger bundle
+    for filename in os.listdir(path):
+        pos = _field_pos(filename)
+        if pos is not None and pos >= nfields:
+            os.remove(os.path.join(path, filename))
+
+def _write_columnar(path, items, index, fields, temp_path, written):
+    """
+    Writes each file to temp_path(filepath) and appends filepath to
+    written. Returns the number of fields.
+    """
+    def save_meta(obj, name):
+        filepath = os.path.join(path, name)
+        written.append(filepath)
+        with open(temp_path(filepath), 'wb') as f:
+            pickle.dump(obj, f)
+
+    shape = (len(index), len(items))
+    names = []
+    for i, (name, values) in enumerate(fields):
+        values = np.asarray(values)
+        if values.shape != shape:
+            raise ValueError("field {0} has shape {1}, expected {2}".format(
+                name, values.shape, shape))
+        filepath = _field_path(path, i)
+        written.append(filepath)
+        # object fields get pickled, _load_array reads them back
+        with open(temp_path(filepath), 'wb') as f:
+            np.save(f, values, allow_pickle=True)
+        names.append(name)
+    save_meta(items, 'items')
+    save_meta(index, 'index')
+    save_meta(names, 'columns')
+    # marks the bundle as columnar
+    save_meta('columnar', 'format')
+    return len(names)
+
+def remove_columnar(path):
+    """
+    Delete the columnar files from a bundle dir, format first so a partial
+    delete isn't read as columnar.
+    """
+    os.remove(os.path.join(path, 'format'))
+    for meta in ['columns', 'items', 'index']:
+        filepath = os.path.join(path, meta)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    for filename in os.listdir(path):
+        if _field_pos(filename) is not None:
+            os.remove(os.path.join(path, filename))
+
+def _load_array(filepath, mmap_mode=None):
+    try:
+        return np.load(filepath, mmap_mode=mmap_mode, allow_pickle=True)
+    except ValueError:
+        if mmap_mode is None:
+            raise
+        # object fields can't be memory mapped
+        return np.load(filepath, allow_pickle=True)
+
+def load_field(path, name, mmap_mode=None):
+    """
+    Load a single field from a columnar bundle as an (index x items) ndarray
+    """
+    names = _load_meta('columns', path)
+    return _load_array(_field_path(path, names.index(name)), mmap_mode=mmap_mode)
+
+def load_columnar(path, columns=None, mmap_mode=None):
+    """
+    Returns
+    -------
+    (items, index, fields) : fields is an OrderedDict of name -> (index x items)
+        ndarray, only the requested columns are read.
+    """
+    from collections import OrderedDict
+
+    load_meta = functools.partial(_load_meta, path=path)
+    items = load_meta('items')
+    index = load_meta('index')
+    names = load_meta('columns')
+    if columns is None:
+        columns = names
+
+    fields = OrderedDict()
+    for name in columns:
+        fields[name] = _load_array(_field_path(path, names.index(name)), mmap_mode=mmap_mode)
+    return items, index, fields
@@ -1,4 +1,5 @@
 from unittest import TestCase
+import os
 
 import pandas as pd
 import numpy as np
@@ -32,6 +33,89 @@ class TestBundle(TestCase):
             test = b.load_panel(td)
             tm.assert_panel_equal(panel, test)
 
+    def test_columnar(self):
+        items = panel.items[:100]
+        index = panel.major_axis
+        columns = list(panel.minor_axis)
+        fields = ((col, panel.ix[items, :, col].values) for col in columns)
+        with TemporaryDirectory() as td:
+            b.save_columnar(td, items, index, fields)
+            assert b.is_columnar(td)
+
+            test_items, test_index, test_fields = b.load_columnar(td)
+            assert test_items.equals(items)
+            assert test_index.equals(index)
+            assert list(test_fields.keys()) == columns
+            for col in columns:
+                correct = panel.ix[items, :, col].values
+                tm.assert_almost_equal(test_fields[col], correct)
+
+            tm.assert_almost_equal(b.load_field(td, 'close'),
+                                   panel.ix[items, :, 'close'].values)
+
+    def test_columnar_overwrite(self):
+        """
+        Saving over a bundle replaces its files, and a failed save leaves
+        the old one alone
+        """
+        items = panel.items[:10]
+        index = panel.major_axis
+        columns = list(panel.minor_axis)
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'bundle')
+            fields = [(col, panel.ix[items, :, col].values) for col in columns]
+            b.save_columnar(path, items, index, fields)
+
+            b.save_columnar(path, items, index, fields[:1])
+            assert sorted(os.listdir(path)) == ['columns', 'field0.npy', 'format',
+                                                'index', 'items']
+            _, _, test_fields = b.load_columnar(path)
+            assert list(test_fields.keys()) == columns[:1]
+
+            def bad_fields():
+                yield fields[1]
+                raise Exception('halfway')
+            self.assertRaises(Exception, b.save_columnar, path, items, index, bad_fields())
+            _, _, test_fields = b.load_columnar(path)
+            assert list(test_fields.keys()) == columns[:1]
+            tm.assert_almost_equal(test_fields[columns[0]], fields[0][1])
+            assert os.listdir(td) == ['bundle']
+            assert sorted(os.listdir(path)) == ['columns', 'field0.npy', 'format',
+                                                'index', 'items']
+
+    def test_columnar_other_files(self):
+        """
+        Files the bundle doesn't own are left alone. Dirs with the same meta
+        names that aren't columnar are not overwritten.
+        """
+        items = pd.Index(['a', 'b'])
+        index = pd.Index(list(range(3)))
+        fields = [('close', np.random.randn(3, 2))]
+        with TemporaryDirectory() as td:
+            notes = os.path.join(td, 'notes.txt')
+            with open(notes, 'w') as f:
+                f.write('keep')
+            b.save_columnar(td, items, index, fields)
+            b.save_columnar(td, items, index, fields)
+            assert os.path.exists(notes)
+            tm.assert_almost_equal(b.load_field(td, 'close'), fields[0][1])
+
+        with TemporaryDirectory() as td:
+            b._save_meta(items, 'items', td)
+            self.assertRaises(ValueError, b.save_columnar, td, items, index, fields)
+            assert os.listdir(td) == ['items']
+
+    def test_columnar_object(self):
+        items = pd.Index(['a', 'b'])
+        index = pd.Index(list(range(3)))
+        values = np.array([['x', 1], ['y', None], ['z', 3.5]], dtype=object)
+        with TemporaryDirectory() as td:
+            b.save_columnar(td, items, index, [('obj', values)])
+            for mmap_mode in [None, 'r']:
+                _, _, fields = b.load_columnar(td, mmap_mode=mmap_mode)
+                assert fields['obj'].dtype == object
+                assert np.all(fields['obj'] == values)
+
 if __name__ == '__main__':                                                                                          
     import nose                                                                      
     nose.runmodule(argv=[__file__,'-vvs','-x','--pdb', '--pdb-failure'],exit=False)   
@@ -2,11 +2,55 @@ import multiprocessing as mp
 import math
 import datetime
 
+import numpy as np
+
 default_consumers = mp.cpu_count() * 2
 
 def chunker(seq, size):
         return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
+def resolve_n_jobs(n_jobs):
+    """
+    n_jobs follows the joblib convention. None is a single job and
+    negative numbers count back from the number of cpus, so -1 is all cpus.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(mp.cpu_count() + 1 + n_jobs, 1)
+    return max(n_jobs, 1)
+
+def share_array(arr):
+    """
+    Copy arr into a new shared memory block.
+
+    Returns
+    -------
+    (spec, shm, view) : spec is a picklable (name, shape, dtype) that
+        attach_array can use from another process. view is an ndarray
+        backed by shm.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject:
+        raise Exception("Cannot put object arrays in shared memory")
+    shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[:] = arr
+    spec = (shm.name, arr.shape, arr.dtype.str)
+    return spec, shm, view
+
+def attach_array(spec):
+    """
+    Attach to an array created by share_array. Returns (shm, view).
+    The view must be dropped before calling shm.close()
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    name, shape, dtype = spec
+    shm = SharedMemory(name=name)
+    view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return shm, view
+
 # OSX Max Queue Size
 MAX_SIZE = 32000
 